@@ -182,6 +182,61 @@ class OAuthTokenResponse(BaseModel):
         import time
         return time.time() <= self.expires_at
 
+def jwt_claims(token):
+    # Decodes the payload only; the signature is the audience's to verify.
+    from base64 import urlsafe_b64decode
+    from json import loads
+    payload = token.split('.')[1]
+    return loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+
+
+class MetadataToken(BaseModel):
+    token: str
+    expires_in: int
+    token_type: str = 'Bearer'
+    issued_at: Optional[float]
+    expires_at: Optional[float]
+
+    @validator('issued_at', always=True, pre=True)
+    def _issued_at(cls, iat):
+        import time
+        return iat or time.time()
+
+    @validator('expires_at', always=True)
+    def _expires_at(cls, exp, values):
+        return exp or values['issued_at'] + values['expires_in']
+
+    @classmethod
+    def from_access_response(cls, response):
+        data = response.json()
+        return cls(token=data['access_token'], expires_in=data['expires_in'], token_type=data['token_type'])
+
+    @classmethod
+    def from_identity_response(cls, response):
+        # The metadata server returns identity tokens as a bare JWT, so the
+        # lifetime is read from its own iat/exp claims.
+        return cls.from_jwt(response.content.decode())
+
+    @classmethod
+    def from_jwt(cls, token):
+        claims = jwt_claims(token)
+        issued_at = claims.get('iat')
+        return cls(
+            token=token,
+            expires_in=claims['exp'] - issued_at if issued_at else 0,
+            issued_at=issued_at,
+            expires_at=claims['exp']
+        )
+
+    def expires_within(self, seconds):
+        import time
+        return time.time() + seconds >= self.expires_at
+
+    @property
+    def valid(self):
+        return not self.expires_within(0)
+
+
 # Review this class.  I dislike from_config_response method.  
 class OAuthTokenRefreshRequest(BaseModel):
     token_uri: str
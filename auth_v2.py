@@ -1,7 +1,10 @@
+import time
 import warnings
 from typing import Union, List
 from httpx import Request, Auth
-from metadata_v2 import Metadata
+from metadata_v2 import Metadata, AsyncMetadata
+from tokens import TokenCache, identity_tokens
+import instrumentation
 
 from auth_models import Portal, OAuthRequest, OAuthTokenResponse
 
@@ -27,26 +30,97 @@ class MetadataAuth(Auth):
 
     requires_response_body = True
 
-    def __init__(self, token_type='access', audience=None, service_account='default'):
+    def __init__(self, token_type='access', audience=None, service_account='default', 
+        metadata=None, async_metadata=None):
         if token_type not in TOKEN_TYPES:
             raise TokenTypeError('token_type must be set to "access" or "identity"') 
-        self.token = None
         self.token_type = token_type
         self.audience = audience
         self.service_account = service_account
-        self.metadata = Metadata()
+        self._metadata = metadata
+        self._async_metadata = async_metadata
+        self._cache = TokenCache(self.fetch_token, self.afetch_token)
+
+    @property
+    def cache(self):
+        # Identity tokens live in the process-wide LRU keyed by
+        # (service_account, audience), so every MetadataAuth for the same
+        # audience shares one token.
+        if self.token_type == 'identity':
+            return identity_tokens.get(
+                self.service_account, self.audience, self.fetch_token, self.afetch_token
+            )
+        return self._cache
+
+    @property
+    def metadata(self):
+        return self._metadata or Metadata.shared()
+
+    @property
+    def async_metadata(self):
+        return self._async_metadata or AsyncMetadata.shared()
+
+    @property
+    def token(self):
+        return self.cache.token.token if self.cache.token else None
+
+    def fetch_token(self):
+        started = time.monotonic()
+        if self.token_type == 'access':
+            token = self.metadata.fetch_access_token(self.service_account)
+        elif self.token_type == 'identity':
+            token = self.metadata.fetch_id_token(self.audience, self.service_account)
+        self.record_refresh(started)
+        return token
+
+    async def afetch_token(self):
+        started = time.monotonic()
+        if self.token_type == 'access':
+            token = await self.async_metadata.fetch_access_token(self.service_account)
+        elif self.token_type == 'identity':
+            token = await self.async_metadata.fetch_id_token(self.audience, self.service_account)
+        self.record_refresh(started)
+        return token
+
+    def record_refresh(self, started):
+        if instrumentation.recorder is not None:
+            instrumentation.recorder.timing('auth.refresh', time.monotonic() - started, self.token_type)
+
+    def record_wait(self, started):
+        # Time a request spent blocked on a token: zero on a cache hit.
+        if instrumentation.recorder is not None:
+            instrumentation.recorder.timing('auth.wait', time.monotonic() - started, self.token_type)
+
+    def record_unauthorized(self):
+        if instrumentation.recorder is not None:
+            instrumentation.recorder.count('auth.unauthorized', operation=self.token_type)
 
     def auth_flow(self, request):
-        request.headers['Authorization'] = f'Bearer {self.token}'
+        started = time.monotonic()
+        token = self.cache.get()
+        self.record_wait(started)
+        request.headers['Authorization'] = f'Bearer {token.token}'
         response = yield request
         
         if response.status_code == 401:
-            if self.token_type == 'access':
-                refresh_response = yield self.metadata.service_account_token_request()
-                self.token = refresh_response.json()['access_token']
-            elif self.token_type == 'identity':
-                refresh_response = yield self.metadata.service_account_id_token_request(self.audience)
-                self.token = refresh_response.content.decode()
+            # The token was revoked or expired early; refresh and retry once.
+            self.record_unauthorized()
+            token = self.cache.refresh(stale=token)
+            request.headers['Authorization'] = f'Bearer {token.token}'
+            yield request
+
+    async def async_auth_flow(self, request):
+        started = time.monotonic()
+        token = await self.cache.aget()
+        self.record_wait(started)
+        request.headers['Authorization'] = f'Bearer {token.token}'
+        response = yield request
+
+        if response.status_code == 401:
+            self.record_unauthorized()
+            token = await self.cache.arefresh(stale=token)
+            request.headers['Authorization'] = f'Bearer {token.token}'
+            yield request
 
 
 class UserAuth(Auth):
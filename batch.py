@@ -0,0 +1,183 @@
+import asyncio
+import email
+import re
+import uuid
+
+from httpx import Response
+
+from models import Blob
+from retry import is_idempotent
+
+BATCH_URL = 'https://storage.googleapis.com/batch/storage/v1'
+# GCS rejects batches of more than 100 calls.
+MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_WINDOW = 0.01
+DEFAULT_MAX_BATCHES = 8
+
+HEAD_SEPARATOR = re.compile(rb'\r?\n\r?\n')
+
+
+class BatchError(Exception):
+    ...
+
+
+def encode_batch(requests, boundary):
+    # multipart/mixed body with one application/http part per call.
+    body = bytearray()
+    for index, request in enumerate(requests):
+        body += (
+            f'--{boundary}\r\n'
+            'Content-Type: application/http\r\n'
+            f'Content-ID: <item-{index}>\r\n\r\n'
+            f'{request.method} {request.url.raw_path.decode()} HTTP/1.1\r\n'
+        ).encode()
+        content = request.content
+        for header in ('Content-Type', 'If-Match', 'If-None-Match'):
+            if header in request.headers:
+                body += f'{header}: {request.headers[header]}\r\n'.encode()
+        if content:
+            body += f'Content-Length: {len(content)}\r\n'.encode()
+        body += b'\r\n' + content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    return bytes(body)
+
+
+def decode_response(data, request):
+    # An embedded "HTTP/1.1 200 OK" response, headers and body.
+    head, body = (HEAD_SEPARATOR.split(data.lstrip(), 1) + [b''])[:2]
+    lines = head.decode('latin-1').splitlines()
+    status = int(lines[0].split()[1])
+    headers = [tuple(part.strip() for part in line.split(':', 1)) for line in lines[1:] if ':' in line]
+    return Response(status, headers=headers, content=body.rstrip(b'\r\n'), request=request)
+
+
+def decode_batch(response, requests):
+    # Maps each part back to its call by Content-ID ("<response-item-N>").
+    message = email.message_from_bytes(
+        b'Content-Type: ' + response.headers['Content-Type'].encode() + b'\r\n\r\n' + response.content
+    )
+    if not message.is_multipart():
+        raise BatchError(f'Expected a multipart batch response, got {response.headers["Content-Type"]}')
+    responses = {}
+    for part in message.get_payload():
+        content_id = part.get('Content-ID', '').strip('<>')
+        index = int(content_id.rpartition('-')[2])
+        responses[index] = decode_response(part.get_payload(decode=True), requests[index])
+    return responses
+
+
+class Batch:
+
+    def __init__(self, client, max_size=MAX_BATCH_SIZE, window=DEFAULT_BATCH_WINDOW,
+        max_batches=DEFAULT_MAX_BATCHES):
+        # Collects calls made through an AsyncStorageClient into batch
+        # requests.  A batch is sent once it holds max_size calls or window
+        # seconds after its first call, whichever comes first, with at most
+        # max_batches in flight.  Each call's awaitable resolves to its own
+        # response; calls answered with a retryable status are queued again
+        # under the client's retry policy.
+        self.client = client
+        self.max_size = min(max_size, MAX_BATCH_SIZE)
+        self.window = window
+        self.semaphore = asyncio.Semaphore(max(1, max_batches))
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.drain()
+
+    def enqueue(self, request, future, attempt=0):
+        self.pending.append((request, future, attempt))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        self.enqueue(request, future)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        calls, self.pending = self.pending, []
+        self.spawn(self.send_batch(calls))
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def drain(self):
+        # Sends whatever is queued and waits for every batch, including
+        # retries queued along the way.
+        while self.pending or self.tasks:
+            self.flush()
+            if self.tasks:
+                await asyncio.wait(set(self.tasks))
+
+    async def send_batch(self, calls):
+        requests = [request for request, _, _ in calls]
+        async with self.semaphore:
+            try:
+                boundary = f'batch_{uuid.uuid4().hex}'
+                request = self.client.build_request(
+                    'POST',
+                    BATCH_URL,
+                    headers={'Content-Type': f'multipart/mixed; boundary={boundary}'},
+                    content=encode_batch(requests, boundary),
+                    extensions={'idempotent': all(is_idempotent(request) for request in requests)}
+                )
+                response = await self.client.send(request)
+                response.raise_for_status()
+                responses = decode_batch(response, requests)
+            except Exception as error:
+                for _, future, _ in calls:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+        for index, (request, future, attempt) in enumerate(calls):
+            if future.done():
+                continue
+            response = responses.get(index)
+            if response is None:
+                future.set_exception(BatchError(f'No response for {request.method} {request.url}'))
+            elif self.client.should_retry(request, attempt, response):
+                self.spawn(self.retry_later(request, future, attempt, response))
+            else:
+                future.set_result(response)
+
+    async def retry_later(self, request, future, attempt, response):
+        await asyncio.sleep(self.client.retry.backoff(attempt, response))
+        self.enqueue(request, future, attempt + 1)
+
+    async def call(self, method, url, **kwargs):
+        response = await self.submit(self.client.build_request(method, url, **kwargs))
+        response.raise_for_status()
+        return response
+
+    async def get_blob(self, bucket, blob, **params):
+        response = await self.call('GET', self.client.blob_path(bucket, blob), params=params)
+        return Blob(**response.json())
+
+    async def patch_blob(self, bucket, blob, metadata, **params):
+        response = await self.call('PATCH', self.client.blob_path(bucket, blob), params=params, json=metadata)
+        return Blob(**response.json())
+
+    async def delete_blob(self, bucket, blob, **params):
+        await self.call('DELETE', self.client.blob_path(bucket, blob), params=params)
+
+    async def rewrite_blob(self, bucket, blob, destination_bucket, destination=None, metadata=None, **params):
+        # Returns the raw rewrite response; large or cross-location copies
+        # come back with done=False and a rewriteToken to continue with.
+        url = self.client.rewrite_path(bucket, blob, destination_bucket, destination or blob)
+        response = await self.call('POST', url, params=params, json=dict(metadata or {}))
+        return response.json()
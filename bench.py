@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from fake_gcs import FakeGCS
+
+BUCKET = 'bench'
+MIB = 1024 * 1024
+
+
+# Each scenario seeds the fake untimed, then returns the coroutine function
+# to time; that returns (operations, bytes transferred).
+
+def bench_listing(fake, client, args):
+    # Paged listing of the whole bucket, as records.
+    for index in range(args.objects):
+        fake.put(BUCKET, f'list/{index % 100:02d}/{index:08d}', b'')
+
+    async def run():
+        items = 0
+        async for _ in client.iter_blobs(BUCKET, prefix='list/', output='record'):
+            items += 1
+        return items, 0
+
+    return run
+
+
+def bench_bulk_download(fake, client, args):
+    # Many small whole-object GETs.
+    data = os.urandom(args.small_size)
+    names = [f'small/{index:08d}' for index in range(args.downloads)]
+    for name in names:
+        fake.put(BUCKET, name, data)
+
+    async def run():
+        total = 0
+        async for result in client.get_blobs(BUCKET, names, max_concurrency=args.concurrency):
+            if not result.ok:
+                raise result.error
+            total += len(result.value)
+        return len(names), total
+
+    return run
+
+
+def bench_range_download(fake, client, args):
+    # One large object in parallel ranges, into a preallocated buffer.
+    size = args.large_size * MIB
+    chunk_size = args.chunk_size * MIB
+    fake.put(BUCKET, 'large/object', os.urandom(size))
+    buffer = bytearray(size)
+
+    async def run():
+        blob = await client.download_blob(
+            BUCKET, 'large/object', buffer, chunk_size=chunk_size, max_concurrency=args.concurrency
+        )
+        return -(-size // chunk_size), int(blob.size)
+
+    return run
+
+
+def bench_ranged_reads(fake, client, args):
+    # Random small records out of one object, coalesced into a buffer.
+    size = args.large_size * MIB
+    fake.put(BUCKET, 'records/object', os.urandom(size))
+    rng = random.Random(args.seed)
+    ranges = [
+        (rng.randrange(size - args.record_size), args.record_size)
+        for _ in range(args.records)
+    ]
+    buffer = bytearray(args.records * args.record_size)
+
+    async def run():
+        blob = await client.get_blob_metadata(BUCKET, 'records/object')
+        await client.read_ranges(BUCKET, blob, ranges, buffer, max_concurrency=args.concurrency)
+        return len(ranges), len(buffer)
+
+    return run
+
+
+def bench_auth_refresh(fake, client, args):
+    # Revokes every token between rounds of concurrent requests, so each
+    # round pays for a 401 and a shared token refresh.
+    fake.put(BUCKET, 'auth/object', b'x')
+
+    async def run():
+        fake.require_auth = True
+        for _ in range(args.auth_rounds):
+            fake.revoke_tokens()
+            await asyncio.gather(*(
+                client.get_blob_metadata(BUCKET, 'auth/object')
+                for _ in range(args.concurrency)
+            ))
+        return args.auth_rounds * args.concurrency, 0
+
+    return run
+
+
+SCENARIOS = {
+    'listing': bench_listing,
+    'bulk_download': bench_bulk_download,
+    'range_download': bench_range_download,
+    'ranged_reads': bench_ranged_reads,
+    'auth_refresh': bench_auth_refresh,
+}
+
+
+async def run_scenario(name, args):
+    fake = FakeGCS(
+        latency=args.latency,
+        jitter=args.jitter,
+        bandwidth=args.bandwidth * MIB if args.bandwidth else None,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        token_latency=args.token_latency,
+        seed=args.seed
+    )
+    client = fake.storage_client()
+    run = SCENARIOS[name](fake, client, args)
+    recorder = instrumentation.enable()
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        ops, transferred = await run()
+    finally:
+        elapsed = time.perf_counter() - started
+        instrumentation.disable()
+        await client.close()
+    snapshot = recorder.snapshot()
+    requests = [
+        histogram
+        for key, histogram in snapshot['histograms'].items()
+        if key.startswith('request.latency')
+    ]
+    # Percentiles are for the scenario's main operation.
+    latency = max(requests, key=lambda histogram: histogram['count'], default=None)
+    result = {
+        'scenario': name,
+        'ops': ops,
+        'seconds': round(elapsed, 4),
+        'ops_per_second': round(ops / elapsed, 1),
+        'mb_per_second': round(transferred / MIB / elapsed, 1),
+        'requests': sum(histogram['count'] for histogram in requests),
+        'p50_ms': round(latency['p50'] * 1000, 3) if latency else None,
+        'p99_ms': round(latency['p99'] * 1000, 3) if latency else None,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'server': dict(fake.stats),
+        'metrics': snapshot
+    }
+    if args.trace_memory:
+        result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / MIB, 1)
+        tracemalloc.stop()
+    return result
+
+
+def report(result):
+    line = (
+        f'{result["scenario"]:<16} {result["ops"]:>9} ops {result["seconds"]:>9.3f}s '
+        f'{result["ops_per_second"]:>11.1f} ops/s {result["mb_per_second"]:>9.1f} MB/s '
+        f'p50 {result["p50_ms"]}ms p99 {result["p99_ms"]}ms rss {result["max_rss_mb"]}MB'
+    )
+    if 'peak_traced_mb' in result:
+        line += f' traced {result["peak_traced_mb"]}MB'
+    return line
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Client benchmarks against the in-process fake GCS.')
+    parser.add_argument('scenarios', nargs='*', help=f'any of {", ".join(SCENARIOS)} (default: all)')
+    parser.add_argument('--objects', type=int, default=20000, help='objects to list')
+    parser.add_argument('--downloads', type=int, default=2000, help='small objects to download')
+    parser.add_argument('--small-size', type=int, default=16 * 1024, help='bytes per small object')
+    parser.add_argument('--large-size', type=int, default=64, help='MiB in the ranged object')
+    parser.add_argument('--chunk-size', type=int, default=8, help='MiB per range')
+    parser.add_argument('--records', type=int, default=5000, help='records read from the ranged object')
+    parser.add_argument('--record-size', type=int, default=4096, help='bytes per record')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--auth-rounds', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='mean extra seconds per request')
+    parser.add_argument('--bandwidth', type=float, default=None, help='MiB/s per media response')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second')
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help='report tracemalloc peaks (slower)')
+    parser.add_argument('--output', help='append results as JSON lines to this file')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+def run_isolated(name, args):
+    # ru_maxrss is a process-wide peak, so each scenario gets a fresh
+    # process to report its own.
+    return asyncio.run(run_scenario(name, args))
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    loop = asyncio.get_running_loop()
+    for name in args.scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = await loop.run_in_executor(pool, run_isolated, name, args)
+        print(report(result))
+        if args.output:
+            with open(args.output, 'a') as dest:
+                dest.write(json.dumps(dict(result, time=time.time()), sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+import hashlib
+import mmap
+import os
+import tempfile
+
+from checksums import verify_blob
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+
+def mmap_file(path):
+    # Read-only, zero-copy view of a file; mmap refuses empty files.
+    with open(path, 'rb') as src:
+        if not os.fstat(src.fileno()).st_size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class BlobCache:
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        # Object bytes on local disk keyed by (bucket, name, generation); a
+        # generation never changes content, so entries never go stale.  Files
+        # are verified and then renamed into place, so workers sharing the
+        # directory only ever see complete, checked entries.
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.used = self.scan()[1]
+
+    def key(self, bucket, name, generation):
+        return hashlib.sha256(f'{bucket}\0{name}\0{generation}'.encode()).hexdigest()
+
+    def path(self, bucket, name, generation):
+        key = self.key(bucket, name, generation)
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, bucket, name, generation):
+        path = self.path(bucket, name, generation)
+        try:
+            view = mmap_file(path)
+        except FileNotFoundError:
+            return None
+        # mtime doubles as last-access time for eviction.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return view
+
+    def temp_path(self, bucket, name, generation):
+        path = self.path(bucket, name, generation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        return temp
+
+    def commit(self, bucket, blob, temp, verify=True):
+        # Verifies temp against the blob's checksums, unless the caller already
+        # did while writing it, moves it into place and returns a view of it.
+        # The file is mapped before the rename, so the view stays valid even
+        # if this or another process evicts the entry right away.
+        try:
+            view = mmap_file(temp)
+            try:
+                if verify:
+                    verify_blob(blob, view)
+                path = self.path(bucket, blob.name, blob.generation)
+                os.replace(temp, path)
+            except BaseException:
+                view.release()
+                raise
+        except BaseException:
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
+            raise
+        self.used += len(view)
+        if self.used > self.max_bytes:
+            self.evict(keep=path)
+        return view
+
+    def scan(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.startswith('.tmp-'):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def evict(self, keep=None):
+        # Rescans, since other processes write here too, then removes the least
+        # recently used files until under max_bytes.  Open mmaps stay valid.
+        # keep, the entry just committed, is never chosen.
+        entries, self.used = self.scan()
+        for _, size, path in sorted(entries):
+            if self.used <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.used -= size
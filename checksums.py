@@ -0,0 +1,191 @@
+import base64
+import hashlib
+
+# Prefer a native crc32c; the table-driven fallback is correct but slow.
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+CRC32C_POLY = 0x82F63B78
+
+
+def _make_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ CRC32C_POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC32C_TABLE = _make_table()
+
+
+def _crc32c_python(data, crc=0):
+    crc ^= 0xFFFFFFFF
+    table = CRC32C_TABLE
+    for byte in memoryview(data).cast('B'):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+if google_crc32c is not None and google_crc32c.implementation == 'c':
+    CRC32C_BACKEND = 'google_crc32c'
+    crc32c = lambda data, crc=0: google_crc32c.extend(crc, data)
+elif _crc32c is not None:
+    CRC32C_BACKEND = 'crc32c'
+    crc32c = lambda data, crc=0: _crc32c.crc32c(data, crc)
+else:
+    CRC32C_BACKEND = 'python'
+    crc32c = _crc32c_python
+
+
+# Checksumming parallel transfers needs crc32c; without a native backend it
+# is skipped unless explicitly requested.
+FAST_CRC32C = CRC32C_BACKEND != 'python'
+
+
+class ChecksumMismatch(Exception):
+    ...
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, matrix[row]) for row in range(32)]
+
+
+def crc32c_combine(crc1, crc2, length2):
+    # crc32c(a + b) from crc32c(a), crc32c(b) and len(b) without touching the
+    # data (zlib's crc32_combine, over the Castagnoli polynomial).  This is
+    # what lets parallel ranges be checksummed independently.
+    if length2 <= 0:
+        return crc1
+    # Operator for one zero bit, squared to two then four zero bits; the
+    # loop below starts at one zero byte.
+    odd = [CRC32C_POLY] + [1 << row for row in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def decode_crc32c(value):
+    return int.from_bytes(base64.b64decode(value), 'big')
+
+
+class Crc32c:
+
+    def __init__(self, crc=0, length=0):
+        self.crc = crc
+        self.length = length
+
+    def update(self, data):
+        self.crc = crc32c(data, self.crc)
+        self.length += len(data)
+
+    def combine(self, other):
+        # Appends another range's checksum, as if its bytes followed ours.
+        self.crc = crc32c_combine(self.crc, other.crc, other.length)
+        self.length += other.length
+
+    def b64digest(self):
+        return encode_crc32c(self.crc)
+
+
+def encode_crc32c(crc):
+    # GCS reports crc32c as base64 of the big-endian 32-bit value.
+    return base64.b64encode(crc.to_bytes(4, 'big')).decode()
+
+
+def encode_md5(digest):
+    return base64.b64encode(digest).decode()
+
+
+def check_crc32c(blob, crc):
+    actual = encode_crc32c(crc)
+    if actual != blob.crc32c:
+        raise ChecksumMismatch(f'crc32c mismatch for {blob.name}: expected {blob.crc32c}, got {actual}')
+
+
+def slow_checksum(blob):
+    # True when verifying blob means the table-driven crc32c (a few MB/s):
+    # no native backend and no md5Hash to fall back on, as for composites.
+    return bool(blob.crc32c) and not blob.md5Hash and not FAST_CRC32C
+
+
+def check_md5(blob, digest):
+    actual = encode_md5(digest)
+    if actual != blob.md5Hash:
+        raise ChecksumMismatch(f'md5 mismatch for {blob.name}: expected {blob.md5Hash}, got {actual}')
+
+
+class StreamVerifier:
+
+    def __init__(self, blob):
+        # Checks a stream incrementally, one chunk at a time, as it is read or
+        # written, with the same crc32c/md5 preference as verify_blob.  When
+        # slow, callers on an event loop should update it from a thread.
+        self.blob = blob
+        use_crc = blob.crc32c and (FAST_CRC32C or not blob.md5Hash)
+        self.crc = Crc32c() if use_crc else None
+        self.md5 = hashlib.md5() if self.crc is None and blob.md5Hash else None
+        self.slow = slow_checksum(blob)
+
+    def update(self, chunk):
+        if self.crc is not None:
+            self.crc.update(chunk)
+        elif self.md5 is not None:
+            self.md5.update(chunk)
+
+    def verify(self):
+        if self.crc is not None:
+            check_crc32c(self.blob, self.crc.crc)
+        elif self.md5 is not None:
+            check_md5(self.blob, self.md5.digest())
+
+
+def verify_blob(blob, data):
+    # Checks data against the blob's crc32c, or its md5Hash when no native
+    # crc32c is installed (composite objects only carry crc32c).
+    if blob.crc32c and (FAST_CRC32C or not blob.md5Hash):
+        check_crc32c(blob, crc32c(data))
+    elif blob.md5Hash:
+        check_md5(blob, hashlib.md5(data).digest())
+
+
+def parse_goog_hash(header):
+    # "crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ==" -> {'crc32c': ..., 'md5': ...}
+    hashes = {}
+    for part in (header or '').split(','):
+        algorithm, _, value = part.strip().partition('=')
+        if value:
+            hashes[algorithm] = value
+    return hashes
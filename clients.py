@@ -1,9 +1,142 @@
 import asyncio
-from httpx import AsyncClient, Request, Client, Auth
-from sniffio import AsyncLibraryNotFoundError
-from auth import MetadataAuth
-from metadata import MetadataServer
-from models import Buckets, Bucket, Blobs, Blob
+import hashlib
+import inspect
+import os
+import time
+import warnings
+from collections import deque
+from urllib.parse import quote, urlencode
+from httpx import AsyncClient, Request, Client, Auth, TransportError, Limits, Timeout, HTTPStatusError
+from auth_v2 import MetadataAuth
+from metadata_v2 import AsyncMetadata
+from models import Bucket, Blob, BucketRecord, BlobRecord
+from concurrency import (
+    DEFAULT_BULK_CONCURRENCY, DEFAULT_MAX_CONCURRENCY, Result, aiter_items, imap_unordered, LoopThread
+)
+from retry import DEFAULT_RETRY_POLICY, DEFAULT_RETRY_BUDGET
+import instrumentation
+from columnar import BlobColumns, COLUMN_FIELDS
+from json_stream import PageParser, loads
+from blob_cache import mmap_file
+from batch import Batch, MAX_BATCH_SIZE, DEFAULT_BATCH_WINDOW
+from copies import REWRITE_FALLBACK_STATUSES, CopyJournal
+from sync import SyncAction, SyncManifest, compare, file_matches, merge_join, parse_location, same_content, walk_local
+from checksums import (
+    FAST_CRC32C, Crc32c, StreamVerifier, check_crc32c, check_md5, decode_crc32c, encode_md5, parse_goog_hash,
+    slow_checksum, verify_blob
+)
+from uploads import (
+    DEFAULT_UPLOAD_CHUNK_SIZE, MAX_COMPOSE_PARTS, UploadError, UploadSource, ResumeState,
+    check_chunk_size, content_range, persisted_offset
+)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_SHARD_BUFFER = 1000
+# Discovered split points are merged down to this many shards per concurrent
+# listing: enough to balance uneven shards without a list call per prefix.
+SHARDS_PER_WORKER = 4
+# Leading characters probed when a namespace has too few prefixes to shard
+# on, in code point (listing) order.
+SPLIT_ALPHABET = '-.0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+# Ranges closer than this are fetched in one request; a request's round trip
+# costs more than reading a few hundred KiB that get thrown away.
+DEFAULT_RANGE_GAP = 256 * 1024
+PAGE_FIELDS = ('nextPageToken', 'prefixes')
+# httpx defaults to 100 connections and a 5 second timeout for every phase;
+# both are too tight for bulk transfers.
+DEFAULT_LIMITS = Limits(max_connections=256, max_keepalive_connections=256, keepalive_expiry=30)
+DEFAULT_TIMEOUT = Timeout(connect=10, read=60, write=60, pool=60)
+
+
+class DownloadError(Exception):
+    ...
+
+
+class _ShardFailure:
+
+    def __init__(self, error):
+        self.error = error
+
+
+def page_fields(fields, delimiter=None):
+    # A `fields` projection must keep the paging keys or pagination stops early.
+    if fields is None:
+        return None
+    required = PAGE_FIELDS if delimiter else PAGE_FIELDS[:1]
+    return ','.join([fields] + [key for key in required if key not in fields])
+
+
+def cache_key(url, params=None):
+    return f'{url}?{urlencode(sorted((key, str(value)) for key, value in (params or {}).items()))}'
+
+
+def byte_ranges(size, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Inclusive (start, end) pairs, as used by the HTTP Range header.
+    return [
+        (start, min(start + chunk_size, size) - 1)
+        for start in range(0, size, chunk_size)
+    ]
+
+
+def merge_split_points(split_points, count):
+    # Keeps count - 1 evenly spaced points, i.e. about count shards.
+    split_points = sorted(set(split_points))
+    if count < 1 or len(split_points) < count:
+        return split_points
+    step = len(split_points) / count
+    return [split_points[int(index * step)] for index in range(1, count)]
+
+
+def coalesce_ranges(ranges, gap=DEFAULT_RANGE_GAP, max_size=DEFAULT_CHUNK_SIZE):
+    # Groups (index, offset, length) pieces into requests: sorted by offset,
+    # a piece joins the previous request when it starts within gap bytes of
+    # its end and the request stays under max_size.  Returns [start, end)
+    # spans with their pieces; empty pieces need no request.
+    groups = []
+    for piece in sorted((piece for piece in ranges if piece[2]), key=lambda piece: piece[1]):
+        _, offset, length = piece
+        if groups:
+            group = groups[-1]
+            end = max(group[1], offset + length)
+            if offset - group[1] <= gap and end - group[0] <= max_size:
+                group[1] = end
+                group[2].append(piece)
+                continue
+        groups.append([offset, offset + length, [piece]])
+    return groups
+
+
+async def aiter_raw(response):
+    # Undecoded body chunks.  Responses built in memory (httpx.MockTransport,
+    # fake_gcs) arrive already read, with nothing left to stream.
+    if response.is_stream_consumed:
+        yield response.content
+        return
+    async for chunk in response.aiter_raw():
+        yield chunk
+
+
+async def update_verifier(verifier, chunk):
+    # The table-driven crc32c would stall the event loop for seconds on a
+    # large object.
+    if verifier.slow:
+        await asyncio.to_thread(verifier.update, chunk)
+    else:
+        verifier.update(chunk)
+
+
+def build_client(limits=DEFAULT_LIMITS, timeout=DEFAULT_TIMEOUT, http2=False, transport=None):
+    # A connection pool that can be shared by several clients (client=...).
+    # http2=True multiplexes concurrent requests over a few connections and
+    # needs the h2 package (pip install httpx[http2]).  The request hook lets
+    # instrumentation measure time spent waiting on the pool.
+    return AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=http2,
+        transport=transport,
+        event_hooks={'request': [instrumentation.mark_dispatched]}
+    )
 
 
 class StorageBucket:
@@ -19,46 +152,162 @@ class AsyncHttpxClient:
         base_url=None, 
         headers=None, 
         params=None, 
-        service_account='default'
+        service_account='default',
+        retry=DEFAULT_RETRY_POLICY,
+        retry_budget=DEFAULT_RETRY_BUDGET,
+        hedge=None,
+        client=None,
+        limits=DEFAULT_LIMITS,
+        timeout=DEFAULT_TIMEOUT,
+        http2=False
     ):
-        self.client = AsyncClient(
-            auth=MetadataAuth(service_account=service_account),
-            base_url=base_url,
-            headers=headers,
-            params=params
-        )
-        self.loop = asyncio.get_event_loop()
+        # retry is a retry.RetryPolicy (None disables retries), retry_budget
+        # the retry.RetryBudget shared by retries and hedges (process-wide by
+        # default) and hedge an optional retry.HedgePolicy for GETs.
+        # client is an AsyncClient to share (see build_client); otherwise one
+        # is built from limits, timeout and http2.  Base URL, headers, params
+        # and auth are applied per request, so a shared pool can serve
+        # clients with different service accounts.
+        self.owns_client = client is None
+        self.client = build_client(limits, timeout, http2) if client is None else client
+        self.base_url = base_url or ''
+        self.headers = dict(headers or {})
+        self.params = dict(params or {})
+        self.auth = MetadataAuth(service_account=service_account)
+        self.retry = retry
+        self.retry_budget = retry_budget
+        self.hedge = hedge
 
     async def close(self):
-        return await self.client.aclose()
+        # A shared pool is left for its owner to close.
+        if self.owns_client:
+            return await self.client.aclose()
 
-    def __del__(self):
-        try:
-            self.loop.run_until_complete(self.close())
-        except AsyncLibraryNotFoundError:
-            pass
-        self.loop.close()
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
     def build_request(self, method, url, **kwargs):
+        if isinstance(url, str) and url.startswith('/'):
+            url = self.base_url + url
+        if self.headers:
+            kwargs['headers'] = {**self.headers, **(kwargs.get('headers') or {})}
+        if self.params:
+            kwargs['params'] = {**self.params, **(kwargs.get('params') or {})}
         return self.client.build_request(method, url, **kwargs)
 
-    async def send(self, request: Request):
-        return await self.client.send(request)
+    async def send(self, request: Request, stream=False):
+        # Retries retryable failures of idempotent requests with jittered
+        # exponential backoff while the retry budget allows.
+        recorder = instrumentation.recorder
+        if recorder is not None:
+            operation = instrumentation.operation_name(request)
+            instrumentation.trace_request(request, operation)
+            started = time.monotonic()
+        if self.retry_budget is not None:
+            self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            response = error = None
+            try:
+                response = await self.send_hedged(request, stream)
+            except TransportError as exc:
+                error = exc
+            if not self.should_retry(request, attempt, response, error):
+                if recorder is not None:
+                    self.record(recorder, operation, started, request, response, error)
+                if error is not None:
+                    raise error
+                return response
+            if recorder is not None:
+                recorder.count('request.retries', operation=operation)
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(self.retry.backoff(attempt, response))
+            attempt += 1
+
+    async def send_many(self, requests: list[Request], max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        # Each request goes through send, so with retries and hedging.
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
 
-    async def send_many(self, requests: list[Request]):
-        awaitables = [
-            self.send(request)
+        async def send(request):
+            async with semaphore:
+                return await self.send(request)
+
+        return await asyncio.gather(*(
+            send(request)
             for request in requests
-        ]
-        return await asyncio.gather(awaitables)
+        ))
 
-    def execute(self, coro):
-        return self.loop.run_until_complete(coro)
+    @staticmethod
+    def record(recorder, operation, started, request, response=None, error=None):
+        recorder.timing('request.latency', time.monotonic() - started, operation)
+        recorder.observe('request.bytes_sent', int(request.headers.get('Content-Length', 0)), operation)
+        if response is None:
+            recorder.count('request.errors', operation=operation)
+            return
+        recorder.count(f'request.status.{response.status_code}', operation=operation)
+        received = response.headers.get('Content-Length')
+        if received is not None:
+            recorder.observe('request.bytes_received', int(received), operation)
 
-    def execute_send(self, request):
-        return self.execute(
-            self.send(request)
-        )
+    def should_retry(self, request, attempt, response=None, error=None):
+        if self.retry is None or attempt + 1 >= self.retry.max_attempts:
+            return False
+        if not self.retry.retryable(request, response, error):
+            return False
+        return self.retry_budget is None or self.retry_budget.withdraw()
+
+    async def send_hedged(self, request, stream=False):
+        # Sends a second copy of a GET once the first has been outstanding
+        # past the hedge threshold; the first response wins and the other
+        # request is cancelled.
+        hedged = self.hedge is not None and request.method == 'GET'
+        delay = self.hedge.delay() if hedged else None
+        started = time.monotonic()
+        if delay is None:
+            # No threshold (yet): a plain send, without a task.
+            response = await self.client.send(request, stream=stream, auth=self.auth)
+            if hedged:
+                self.hedge.record(time.monotonic() - started)
+            return response
+        first = asyncio.ensure_future(self.client.send(request, stream=stream, auth=self.auth))
+        try:
+            await asyncio.wait({first}, timeout=delay)
+            if first.done() or (self.retry_budget is not None and not self.retry_budget.withdraw()):
+                response = await first
+                self.hedge.record(time.monotonic() - started)
+                return response
+        except BaseException:
+            first.cancel()
+            raise
+
+        if instrumentation.recorder is not None:
+            instrumentation.recorder.count('request.hedges', operation=instrumentation.operation_name(request))
+        second = asyncio.ensure_future(self.client.send(request, stream=stream, auth=self.auth))
+        pending = {first, second}
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None and task.exception() is None:
+                        winner = task
+            if winner is None:
+                # Both failed; surface the original request's error.
+                return first.result()
+            self.hedge.record(time.monotonic() - started)
+            return winner.result()
+        finally:
+            for task in (first, second):
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
 
 
 class AsyncStorageClient(AsyncHttpxClient):
@@ -69,65 +318,1164 @@ class AsyncStorageClient(AsyncHttpxClient):
     LIST_BUCKETS = '/b'
     GET_BUCKET = '/b/{bucket}'
     LIST_BLOBS = '/b/{bucket}/o'
+    GET_BLOB = '/b/{bucket}/o/{blob}'
+    COMPOSE_BLOB = '/b/{bucket}/o/{blob}/compose'
+    REWRITE_BLOB = '/b/{bucket}/o/{blob}/rewriteTo/b/{destination_bucket}/o/{destination}'
+    UPLOAD_BLOB = 'https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o'
 
     def __init__(self, 
         project_id=None,
-        service_account='default'
+        service_account='default',
+        metadata=None,
+        cache=None,
+        blob_cache=None,
+        retry=DEFAULT_RETRY_POLICY,
+        retry_budget=DEFAULT_RETRY_BUDGET,
+        hedge=None,
+        client=None,
+        limits=DEFAULT_LIMITS,
+        timeout=DEFAULT_TIMEOUT,
+        http2=False
     ):
-        self.metadata = MetadataServer()
-        self.project = self.metadata.get_project_id() if not project_id else project_id
+        # The project is looked up lazily, on the loop, by get_project.
+        # cache is an optional metadata_cache.MetadataCache and blob_cache an
+        # optional blob_cache.BlobCache.
+        self.metadata = metadata
+        self.project = project_id
+        self.cache = cache
+        self.blob_cache = blob_cache
 
         super().__init__(
             base_url=self.BASE_URL,
             headers=self.HEADERS,
             params=self.PARAMS,
-            service_account=service_account
+            service_account=service_account,
+            retry=retry,
+            retry_budget=retry_budget,
+            hedge=hedge,
+            client=client,
+            limits=limits,
+            timeout=timeout,
+            http2=http2
         )
     
-    def list_buckets(self, output='model'):
-        request = self.build_request('GET', self.LIST_BUCKETS, params={'project': self.project})
-        response = self.execute_send(request).json() 
-        if output == 'model':
-            return (
-                Bucket(**bucket.dict())
-                for bucket in Buckets(**response).items 
+    async def get_project(self):
+        if self.project is None:
+            metadata = self.metadata or AsyncMetadata.shared()
+            self.project = await metadata.get_project_id()
+        return self.project
+
+    async def get_resource(self, url, params=None, revalidate=False):
+        # GET for bucket or object metadata.  With a cache, fresh entries are
+        # returned as is and stale ones are revalidated: an unchanged resource
+        # costs a 304.  Objects are pinned to the cached generation, so an
+        # overwritten object fails the precondition (412) and is refetched.
+        # revalidate treats every entry as stale.
+        params = dict(params or {})
+        key = cache_key(url, params)
+        entry = self.cache.get(key) if self.cache is not None else None
+        if entry is not None and not revalidate and self.cache.fresh(entry):
+            return entry.value
+        headers = {}
+        conditional = dict(params)
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.metageneration:
+                conditional['ifMetagenerationNotMatch'] = entry.metageneration
+            if entry.value.get('generation'):
+                conditional['ifGenerationMatch'] = entry.value['generation']
+        request = self.build_request('GET', url, params=conditional, headers=headers)
+        response = await self.send(request)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key)
+            return entry.value
+        if response.status_code == 412 and entry is not None:
+            request = self.build_request('GET', url, params=params)
+            response = await self.send(request)
+        response.raise_for_status()
+        resource = response.json()
+        if self.cache is not None:
+            self.cache.put(key, resource, resource.get('etag'), resource.get('metageneration'))
+        return resource
+
+    async def iter_pages(self, url, params=None):
+        # Follows nextPageToken, fetching the next page while the caller is
+        # still consuming the current one.
+        params = {
+            key: value
+            for key, value in (params or {}).items()
+            if value is not None
+        }
+
+        async def fetch(page_token=None):
+            page_params = dict(params, pageToken=page_token) if page_token else params
+            # Listings can't be revalidated, so cached pages only live for the ttl.
+            if self.cache is not None:
+                key = cache_key(url, page_params)
+                entry = self.cache.get(key)
+                if entry is not None and self.cache.fresh(entry):
+                    return entry.value
+            request = self.build_request('GET', url, params=page_params)
+            response = await self.send(request)
+            response.raise_for_status()
+            page = loads(response.content)
+            if self.cache is not None:
+                self.cache.put(key, page)
+            return page
+
+        task = asyncio.ensure_future(fetch())
+        try:
+            while task is not None:
+                page = await task
+                page_token = page.get('nextPageToken')
+                task = asyncio.ensure_future(fetch(page_token)) if page_token else None
+                yield page
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def iter_items_streaming(self, url, params=None):
+        # Yields a listing's items as each one finishes arriving, without
+        # holding whole pages; the next page is requested as soon as its
+        # token has been parsed.  Pages are not cached.
+        params = {
+            key: value
+            for key, value in (params or {}).items()
+            if value is not None
+        }
+
+        async def open_page(page_token=None):
+            page_params = dict(params, pageToken=page_token) if page_token else params
+            response = await self.send(self.build_request('GET', url, params=page_params), stream=True)
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            return response
+
+        task = asyncio.ensure_future(open_page())
+        try:
+            while task is not None:
+                response = await task
+                task = None
+                parser = PageParser()
+                try:
+                    async for chunk in response.aiter_bytes():
+                        items = parser.feed(chunk)
+                        page_token = parser.page.get('nextPageToken')
+                        if task is None and page_token:
+                            task = asyncio.ensure_future(open_page(page_token))
+                        for item in items:
+                            yield item
+                    for item in parser.close():
+                        yield item
+                finally:
+                    await response.aclose()
+                page_token = parser.page.get('nextPageToken')
+                if task is None and page_token:
+                    task = asyncio.ensure_future(open_page(page_token))
+        finally:
+            if task is not None:
+                task.cancel()
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+
+    async def iter_bucket_pages(self, prefix=None, max_results=None, fields=None, project=None):
+        params = {
+            'project': project or await self.get_project(),
+            'prefix': prefix,
+            'maxResults': max_results,
+            'fields': page_fields(fields)
+        }
+        async for page in self.iter_pages(self.LIST_BUCKETS, params):
+            yield page
+
+    async def iter_buckets(self, prefix=None, max_results=None, fields=None, project=None, output='model'):
+        async for page in self.iter_bucket_pages(prefix, max_results, fields, project):
+            if output in ('response', 'page'):
+                yield page
+            elif output == 'model':
+                for bucket in page.get('items', ()):
+                    yield Bucket(**bucket)
+            elif output == 'record':
+                for bucket in page.get('items', ()):
+                    yield BucketRecord(bucket)
+            else:
+                for bucket in page.get('items', ()):
+                    yield bucket
+
+    def blob_list_params(self, prefix=None, delimiter=None, max_results=None, fields=None, **params):
+        params.update({
+            'prefix': prefix,
+            'delimiter': delimiter,
+            'maxResults': max_results,
+            'fields': page_fields(fields, delimiter)
+        })
+        return params
+
+    async def iter_blob_pages(self, bucket, prefix=None, delimiter=None, max_results=None, fields=None, **params):
+        params = self.blob_list_params(prefix, delimiter, max_results, fields, **params)
+        async for page in self.iter_pages(self.LIST_BLOBS.format(bucket=bucket), params):
+            yield page
+
+    async def iter_blobs(self, bucket, prefix=None, delimiter=None, max_results=None, fields=None, output='model', 
+        stream=False, **params):
+        # max_results is the page size; all pages are followed.  Prefixes found
+        # with a delimiter are only returned with output='response'.
+        # output='record' yields unvalidated BlobRecords, the cheap option for
+        # large listings.  stream=True parses each page incrementally and
+        # yields items as they arrive (not with output='response').
+        if stream and output not in ('response', 'page'):
+            params = self.blob_list_params(prefix, delimiter, max_results, fields, **params)
+            async for blob in self.iter_items_streaming(self.LIST_BLOBS.format(bucket=bucket), params):
+                if output == 'model':
+                    yield Blob(**blob)
+                elif output == 'record':
+                    yield BlobRecord(blob)
+                else:
+                    yield blob
+            return
+        async for page in self.iter_blob_pages(bucket, prefix, delimiter, max_results, fields, **params):
+            if output in ('response', 'page'):
+                yield page
+            elif output == 'model':
+                for blob in page.get('items', ()):
+                    yield Blob(**blob)
+            elif output == 'record':
+                for blob in page.get('items', ()):
+                    yield BlobRecord(blob)
+            else:
+                for blob in page.get('items', ()):
+                    yield blob
+
+    async def discover_split_points(self, bucket, prefix=None, delimiter='/', count=None, 
+        max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # One delimiter listing with a prefixes-only projection returns the
+        # key space's top-level "directories", which make natural shard bounds.
+        # With count, they are merged down to about count shards, and a flat
+        # namespace with fewer prefixes than that is split by sampling.
+        split_points = []
+        async for page in self.iter_blob_pages(bucket, prefix=prefix, delimiter=delimiter, fields='prefixes'):
+            split_points.extend(page.get('prefixes', ()))
+        if count is None:
+            return sorted(split_points)
+        if len(split_points) < count:
+            split_points += await self.sample_split_points(bucket, prefix, count, max_concurrency)
+        return merge_split_points(split_points, count)
+
+    async def first_blob_name(self, bucket, prefix=None, start=None):
+        params = self.blob_list_params(prefix, max_results=1, fields='items(name)', startOffset=start)
+        request = self.build_request('GET', self.LIST_BLOBS.format(bucket=bucket), params={
+            key: value for key, value in params.items() if value is not None
+        })
+        response = await self.send(request)
+        response.raise_for_status()
+        items = loads(response.content).get('items')
+        return items[0]['name'] if items else None
+
+    async def next_chars(self, bucket, base, limit):
+        # The distinct characters names continue base with, in order, by skip
+        # scanning: each maxResults=1 probe starts past every name that
+        # continues with the character the previous one found.
+        chars = []
+        start = None
+        while len(chars) < limit:
+            name = await self.first_blob_name(bucket, base, start)
+            if name is None:
+                break
+            if len(name) == len(base):
+                start = base + '\0'
+                continue
+            char = name[len(base)]
+            chars.append(char)
+            start = base + chr(ord(char) + 1)
+        return chars
+
+    async def sample_split_points(self, bucket, prefix=None, count=1, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # Walks the tree of name prefixes breadth first until it has about
+        # count of them: prefixes every name shares (zero-padded ids, dates,
+        # a single top directory) are descended through, and each level is
+        # only as wide as the names actually branch.
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def expand(base):
+            async with semaphore:
+                chars = await self.next_chars(bucket, base, count)
+            # A name with nothing after it stays a point of its own.
+            return [base + char for char in chars] or [base]
+
+        frontier = [prefix or '']
+        while len(frontier) < count:
+            points = [point for points in await asyncio.gather(*(expand(base) for base in frontier)) for point in points]
+            if points == frontier:
+                break
+            frontier = points
+        return [point for point in frontier if point != (prefix or '')]
+
+    async def iter_blobs_sharded(self, bucket, prefix=None, split_points=None, delimiter='/', 
+        max_concurrency=DEFAULT_MAX_CONCURRENCY, ordered=False, buffer_size=DEFAULT_SHARD_BUFFER, 
+        output='model', **params):
+        # Splits the key space into lexicographic [startOffset, endOffset) ranges
+        # at split_points, lists up to max_concurrency ranges at once and merges
+        # them into one stream.  When not given, split points are discovered
+        # with the delimiter (or sampled) and merged to SHARDS_PER_WORKER
+        # shards per concurrent listing.  With ordered=True the output is in
+        # the same order as iter_blobs.
+        if split_points is None:
+            split_points = await self.discover_split_points(
+                bucket, prefix, delimiter, SHARDS_PER_WORKER * max(1, max_concurrency), max_concurrency
             )
-        elif output in ('response','dict'):
-           return response
+        bounds = [None] + sorted(set(split_points)) + [None]
+        shards = list(zip(bounds, bounds[1:]))
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        done = object()
+        if ordered:
+            queues = [asyncio.Queue(buffer_size) for _ in shards]
+        else:
+            queues = [asyncio.Queue(buffer_size)] * len(shards)
+        tasks = []
+
+        async def produce(start, end, queue):
+            try:
+                async for item in self.iter_blobs(
+                    bucket, prefix=prefix, startOffset=start, endOffset=end, output=output, **params
+                ):
+                    await queue.put(item)
+            except Exception as error:
+                await queue.put(_ShardFailure(error))
+            finally:
+                semaphore.release()
+            await queue.put(done)
+
+        async def launch():
+            # Permits are taken in shard order, so in ordered mode the shard
+            # being consumed is always running or finished.
+            for (start, end), queue in zip(shards, queues):
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(produce(start, end, queue)))
+
+        launcher = asyncio.ensure_future(launch())
+        try:
+            remaining = len(shards)
+            queue_iter = iter(queues)
+            queue = next(queue_iter)
+            while remaining:
+                item = await queue.get()
+                if item is done:
+                    remaining -= 1
+                    if ordered and remaining:
+                        queue = next(queue_iter)
+                elif isinstance(item, _ShardFailure):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            launcher.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def list_blobs_columnar(self, bucket, prefix=None, fields=COLUMN_FIELDS, columns=None, 
+        sharded=False, **kwargs):
+        # Collects the listing into a columnar.BlobColumns, one page at a time.
+        # Pass columns to keep appending across buckets or calls.
+        columns = BlobColumns() if columns is None else columns
+        if sharded:
+            pages = self.iter_blobs_sharded(bucket, prefix=prefix, fields=fields, output='page', **kwargs)
+        else:
+            pages = self.iter_blob_pages(bucket, prefix=prefix, fields=fields, **kwargs)
+        async for page in pages:
+            columns.append_page(page)
+        return columns
+
+    async def list_buckets(self, output='model', **kwargs):
+        return [bucket async for bucket in self.iter_buckets(output=output, **kwargs)]
     
-    def get_bucket(self, bucket, output='model'):
-        request = self.build_request('GET', self.GET_BUCKET.format(bucket=bucket))
-        response = self.execute_send(request).json()
+    async def get_bucket(self, bucket, output='model'):
+        response = await self.get_resource(self.GET_BUCKET.format(bucket=bucket))
         if output == 'model':
             return Bucket(**response, client=self.client)
         elif output in ('response', 'dict'):
             return response
 
-    def list_blobs(self, bucket, output='model'):
-        request = self.build_request('GET', self.LIST_BLOBS.format(bucket=bucket))
-        response = self.execute_send(request).json()
-        if output == 'model':
-            return (
-                Blob(**blob.dict())
-                for blob in Blobs(**response).items
+    async def list_blobs(self, bucket, output='model', **kwargs):
+        return [blob async for blob in self.iter_blobs(bucket, output=output, **kwargs)]
+
+    def blob_path(self, bucket, blob, path=None):
+        return (path or self.GET_BLOB).format(bucket=bucket, blob=quote(blob, safe=''))
+
+    async def get_blob_metadata(self, bucket, blob, revalidate=False):
+        return Blob(**await self.get_resource(self.blob_path(bucket, blob), revalidate=revalidate))
+
+    async def resolve_blob(self, bucket, blob):
+        # Accepts a Blob model, a BlobRecord or a blob name.  Names are
+        # resolved for reading or copying the data, which needs the current
+        # generation and mediaLink: a cached entry is always revalidated (a
+        # 304 when unchanged), never served stale.
+        if isinstance(blob, (Blob, BlobRecord)):
+            return blob
+        return await self.get_blob_metadata(bucket, blob, revalidate=True)
+
+    def build_media_request(self, url, start=None, end=None, **kwargs):
+        # Media bodies are read undecoded (aiter_raw).  Accepting gzip stops
+        # GCS transcoding objects stored with Content-Encoding: gzip, so the
+        # bytes match blob.size, Range offsets and the stored checksums.
+        headers = {'Accept-Encoding': 'gzip'}
+        if start is not None:
+            headers['Range'] = f'bytes={start}-{end}'
+        return self.build_request('GET', url, headers=headers, **kwargs)
+
+    async def read_media(self, request):
+        # Returns the response and its raw body.
+        response = await self.send(request, stream=True)
+        try:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            return response, b''.join([chunk async for chunk in aiter_raw(response)])
+        finally:
+            await response.aclose()
+
+    async def get_range(self, url, start, end):
+        _, content = await self.read_media(self.build_media_request(url, start, end))
+        if len(content) != end - start + 1:
+            raise DownloadError(f'Expected {end - start + 1} bytes for range {start}-{end}, got {len(content)}')
+        return content
+
+    async def download_range(self, url, start, end, write, checksum=False):
+        # Streams one range and hands each chunk to write(offset, chunk) as it
+        # arrives.  With checksum, returns the range's Crc32c, computed as the
+        # chunks go by.
+        crc = Crc32c() if checksum else None
+        response = await self.send(self.build_media_request(url, start, end), stream=True)
+        try:
+            response.raise_for_status()
+            offset = start
+            async for chunk in aiter_raw(response):
+                if offset + len(chunk) > end + 1:
+                    raise DownloadError(f'Received more than {end - start + 1} bytes for range {start}-{end}')
+                write(offset, chunk)
+                if crc is not None:
+                    crc.update(chunk)
+                offset += len(chunk)
+        finally:
+            await response.aclose()
+        if offset != end + 1:
+            raise DownloadError(f'Expected {end - start + 1} bytes for range {start}-{end}, got {offset - start}')
+        return crc
+
+    async def get_blob(self, bucket, blob, chunk_size=DEFAULT_CHUNK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY, 
+        verify=True):
+        # Yields the object's bytes in order.  Objects larger than chunk_size are
+        # fetched as concurrent Range requests, at most max_concurrency ahead of
+        # the consumer, so memory stays bounded at max_concurrency * chunk_size.
+        # With verify, the checksum is updated per chunk and checked once the
+        # last chunk has been yielded (ChecksumMismatch on failure).
+        blob = await self.resolve_blob(bucket, blob)
+        size = int(blob.size)
+        verifier = StreamVerifier(blob) if verify else None
+        if size <= chunk_size:
+            response = await self.send(self.build_media_request(blob.mediaLink), stream=True)
+            try:
+                response.raise_for_status()
+                async for chunk in aiter_raw(response):
+                    if verifier is not None:
+                        await update_verifier(verifier, chunk)
+                    yield chunk
+            finally:
+                await response.aclose()
+            if verifier is not None:
+                verifier.verify()
+            return
+
+        ranges = iter(byte_ranges(size, chunk_size))
+        pending = deque()
+
+        def schedule():
+            for start, end in ranges:
+                pending.append(asyncio.ensure_future(self.get_range(blob.mediaLink, start, end)))
+                return
+
+        try:
+            for _ in range(max(1, max_concurrency)):
+                schedule()
+            while pending:
+                chunk = await pending.popleft()
+                schedule()
+                if verifier is not None:
+                    await update_verifier(verifier, chunk)
+                yield chunk
+        finally:
+            for task in pending:
+                task.cancel()
+        if verifier is not None:
+            verifier.verify()
+
+    async def download_blob(self, bucket, blob, destination, chunk_size=DEFAULT_CHUNK_SIZE, 
+        max_concurrency=DEFAULT_MAX_CONCURRENCY, verify=None):
+        # Writes the object into destination, which is either a file path or a
+        # writable buffer (bytearray, memoryview, mmap, C-contiguous
+        # numpy.ndarray).  Ranges are written in place as they arrive, so the
+        # object is never held in memory whole.
+        # Each range is crc32c'd as it streams and the range checksums are
+        # combined, so verification needs no second pass.  Without a native
+        # crc32c the finished object is checked against its md5Hash in a
+        # thread instead.  Composites have no md5Hash; by default they are
+        # then left unverified with a warning, and verify=True runs the slow
+        # crc32c in a thread.
+        blob = await self.resolve_blob(bucket, blob)
+        size = int(blob.size)
+        if verify is None and slow_checksum(blob):
+            warnings.warn(
+                f'{blob.name} is not verified: it has no md5Hash and no native crc32c is installed '
+                '(pip install google-crc32c)',
+                stacklevel=2
             )
-        elif output in ('response', 'dict'):
-            return response
+            verify = False
+        verify = verify is not False and bool(blob.crc32c or blob.md5Hash)
+        streaming = verify and FAST_CRC32C and bool(blob.crc32c)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def fetch(start, end, write):
+            async with semaphore:
+                return await self.download_range(blob.mediaLink, start, end, write, checksum=streaming)
+
+        async def fetch_all(write):
+            crcs = await asyncio.gather(*(
+                fetch(start, end, write)
+                for start, end in byte_ranges(size, chunk_size)
+            ))
+            if streaming:
+                crc = Crc32c()
+                for range_crc in crcs:
+                    crc.combine(range_crc)
+                check_crc32c(blob, crc.crc)
+
+        if isinstance(destination, (str, os.PathLike)):
+            fd = os.open(destination, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if size and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+                await fetch_all(lambda offset, chunk: os.pwrite(fd, chunk, offset))
+            finally:
+                os.close(fd)
+            if verify and not streaming:
+                view = mmap_file(destination)
+                try:
+                    await asyncio.to_thread(verify_blob, blob, view)
+                finally:
+                    view.release()
+        else:
+            view = memoryview(destination).cast('B')
+            if len(view) < size:
+                raise DownloadError(f'Destination holds {len(view)} bytes, {blob.name} is {size} bytes')
+
+            def write(offset, chunk):
+                view[offset:offset + len(chunk)] = chunk
+
+            await fetch_all(write)
+            if verify and not streaming:
+                await asyncio.to_thread(verify_blob, blob, view[:size])
+        return blob
+
+    async def read_blob(self, bucket, blob, chunk_size=DEFAULT_CHUNK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # Returns the object's bytes as a memoryview, checksum-verified.  With a
+        # blob_cache this reads through it: hits are mmapped from disk, misses
+        # are downloaded into the cache directory, verified, then mmapped.
+        blob = await self.resolve_blob(bucket, blob)
+        if self.blob_cache is None:
+            buffer = bytearray(int(blob.size))
+            await self.download_blob(bucket, blob, buffer, chunk_size, max_concurrency, verify=True)
+            return memoryview(buffer)
+        view = self.blob_cache.get(bucket, blob.name, blob.generation)
+        if view is not None:
+            return view
+        temp = self.blob_cache.temp_path(bucket, blob.name, blob.generation)
+        try:
+            await self.download_blob(bucket, blob, temp, chunk_size, max_concurrency, verify=True)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return self.blob_cache.commit(bucket, blob, temp, verify=False)
+
+    async def read_ranges(self, bucket, blob, ranges, destination=None, gap=DEFAULT_RANGE_GAP, 
+        max_request_size=DEFAULT_CHUNK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # Reads many (offset, length) ranges of one object.  Nearby ranges are
+        # coalesced into a single Range request (see coalesce_ranges) and the
+        # response is scattered straight into destination, a writable buffer
+        # (bytearray, numpy.ndarray, mmap) that receives the ranges packed
+        # back to back in the order given.  Returns a memoryview per range
+        # into destination, or into one bytearray allocated for all of them.
+        # The bytes in a gap between coalesced ranges are never kept.
+        blob = await self.resolve_blob(bucket, blob)
+        size = int(blob.size)
+        pieces, position = [], 0
+        for index, (offset, length) in enumerate(ranges):
+            if offset < 0 or length < 0 or offset + length > size:
+                raise DownloadError(f'Range {offset}+{length} is outside {blob.name} ({size} bytes)')
+            pieces.append((index, offset, length, position))
+            position += length
+        view = memoryview(destination if destination is not None else bytearray(position)).cast('B')
+        if len(view) < position:
+            raise DownloadError(f'Destination holds {len(view)} bytes, the ranges need {position}')
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        targets = {index: target for index, _, _, target in pieces}
+
+        async def fetch(group):
+            start, end, members = group
+            # Chunks arrive in offset order, so members before `first` are
+            # already complete.
+            first = 0
+
+            def write(offset, chunk):
+                nonlocal first
+                chunk = memoryview(chunk)
+                chunk_end = offset + len(chunk)
+                while first < len(members) and members[first][1] + members[first][2] <= offset:
+                    first += 1
+                for index, piece_offset, length in members[first:]:
+                    if piece_offset >= chunk_end:
+                        break
+                    low, high = max(offset, piece_offset), min(chunk_end, piece_offset + length)
+                    if low < high:
+                        target = targets[index] + low - piece_offset
+                        view[target:target + high - low] = chunk[low - offset:high - offset]
+
+            async with semaphore:
+                await self.download_range(blob.mediaLink, start, end - 1, write)
+
+        groups = coalesce_ranges(
+            [(index, offset, length) for index, offset, length, _ in pieces], gap, max_request_size
+        )
+        await asyncio.gather(*(fetch(group) for group in groups))
+        return [view[target:target + length] for _, _, length, target in pieces]
+
+    async def get_blob_bytes(self, bucket, blob, verify=True):
+        # Single GET for the whole object; names skip the metadata round trip.
+        # The body is checked against the response's x-goog-hash header.
+        if isinstance(blob, (Blob, BlobRecord)):
+            request = self.build_media_request(blob.mediaLink)
+        else:
+            request = self.build_media_request(self.blob_path(bucket, blob), params={'alt': 'media'})
+        response, content = await self.read_media(request)
+        if verify:
+            hashes = parse_goog_hash(response.headers.get('x-goog-hash'))
+            name = blob if isinstance(blob, str) else blob.name
+            expected = Blob(name=name, crc32c=hashes.get('crc32c'), md5Hash=hashes.get('md5'))
+            if slow_checksum(expected):
+                await asyncio.to_thread(verify_blob, expected, content)
+            else:
+                verify_blob(expected, content)
+        return content
+
+    async def get_blobs(self, bucket, blobs, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        # blobs is a list or (async) iterable of names or Blob models.  Yields a
+        # concurrency.Result per blob, in completion order; result.value holds
+        # the bytes and result.error any per-item failure.
+        async for result in imap_unordered(
+            lambda blob: self.get_blob_bytes(bucket, blob),
+            blobs,
+            max_concurrency=max_concurrency
+        ):
+            yield result
+
+
+    async def delete_blob(self, bucket, blob, **params):
+        request = self.build_request('DELETE', self.blob_path(bucket, blob), params=params)
+        response = await self.send(request)
+        response.raise_for_status()
+
+    def batch(self, max_size=MAX_BATCH_SIZE, window=DEFAULT_BATCH_WINDOW):
+        # Groups get/patch/delete/rewrite calls into /batch/storage/v1
+        # requests; use as `async with client.batch() as batch:`.
+        return Batch(self, max_size, window)
+
+    async def start_resumable_upload(self, bucket, name, content_type=None, metadata=None, size=None):
+        headers = {'X-Upload-Content-Type': content_type or 'application/octet-stream'}
+        if size is not None:
+            headers['X-Upload-Content-Length'] = str(size)
+        request = self.build_request(
+            'POST',
+            self.UPLOAD_BLOB.format(bucket=bucket),
+            params={'uploadType': 'resumable'},
+            headers=headers,
+            json=dict(metadata or {}, name=name, contentType=content_type)
+        )
+        response = await self.send(request)
+        response.raise_for_status()
+        return response.headers['Location']
+
+    async def query_resumable_upload(self, session_uri, size=None):
+        # Returns the persisted offset, the finished Blob, or None when the
+        # session has expired and the upload has to start over.
+        request = self.build_request('PUT', session_uri, headers={'Content-Range': content_range(0, 0, size)})
+        response = await self.send(request)
+        if response.status_code in (200, 201):
+            return Blob(**response.json())
+        if response.status_code == 308:
+            return persisted_offset(response)
+        if response.status_code in (404, 410):
+            return None
+        response.raise_for_status()
+
+    async def upload_resumable(self, bucket, name, source, content_type=None, metadata=None, 
+        chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, state=None, checksum=True):
+        # With checksum, a hash of the persisted bytes is kept as the upload
+        # goes and sent with the final chunk as X-Goog-Hash, so GCS rejects a
+        # corrupted upload: crc32c with a native backend, which is saved with
+        # the resume state, otherwise md5, which is rehashed from the source
+        # on resume.
+        check_chunk_size(chunk_size)
+        key = f'{bucket}/{name}'
+        saved = state.get(key) if state is not None and source.seekable else None
+        offset = None
+        crc = md5 = None
+        if saved and saved.get('size') == source.size:
+            session_uri = saved['session_uri']
+            offset = await self.query_resumable_upload(session_uri, source.size)
+            if isinstance(offset, Blob):
+                state.discard(key)
+                return offset
+            if offset is not None and checksum:
+                if FAST_CRC32C:
+                    crc = await self.resume_crc32c(source, saved, offset)
+                else:
+                    md5 = await self.resume_md5(source, offset, chunk_size)
+        if offset is None:
+            session_uri = await self.start_resumable_upload(bucket, name, content_type, metadata, source.size)
+            offset = 0
+            if checksum and FAST_CRC32C:
+                crc = Crc32c()
+            elif checksum:
+                md5 = hashlib.md5()
+
+        def save():
+            if state is not None and source.seekable:
+                state.set(key, {
+                    'session_uri': session_uri, 
+                    'size': source.size, 
+                    'offset': offset, 
+                    'crc32c': crc.crc if crc is not None else None
+                })
+
+        save()
+        while True:
+            chunk, last = await source.read(offset, chunk_size)
+            total = offset + len(chunk) if last else None
+            headers = {'Content-Range': content_range(offset, len(chunk), total)}
+            final_crc = final_md5 = None
+            if last and crc is not None:
+                final_crc = Crc32c(crc.crc, crc.length)
+                final_crc.update(chunk)
+                headers['X-Goog-Hash'] = f'crc32c={final_crc.b64digest()}'
+            elif last and md5 is not None:
+                final_md5 = md5.copy()
+                final_md5.update(chunk)
+                headers['X-Goog-Hash'] = f'md5={encode_md5(final_md5.digest())}'
+            request = self.build_request(
+                'PUT',
+                session_uri,
+                headers=headers,
+                content=bytes(chunk) if isinstance(chunk, memoryview) else chunk
+            )
+            response = await self.send(request)
+            if response.status_code in (200, 201):
+                if state is not None:
+                    state.discard(key)
+                blob = Blob(**response.json())
+                if final_crc is not None and blob.crc32c:
+                    check_crc32c(blob, final_crc.crc)
+                elif final_md5 is not None and blob.md5Hash:
+                    check_md5(blob, final_md5.digest())
+                return blob
+            if response.status_code != 308:
+                response.raise_for_status()
+                raise UploadError(f'Unexpected {response.status_code} uploading {key}')
+            # The server may persist less than was sent; resume from its offset.
+            persisted = persisted_offset(response)
+            if crc is not None:
+                crc.update(chunk[:persisted - offset])
+            elif md5 is not None:
+                md5.update(chunk[:persisted - offset])
+            offset = persisted
+            save()
+
+    async def resume_crc32c(self, source, saved, offset):
+        # Rebuilds the running crc for a resumed session from the saved one,
+        # hashing any bytes the server persisted after the state was written.
+        if saved.get('crc32c') is None or saved.get('offset', 0) > offset:
+            return None
+        crc = Crc32c(saved['crc32c'], saved['offset'])
+        if offset > crc.length:
+            gap, _ = await source.read(crc.length, offset - crc.length)
+            crc.update(gap)
+        return crc
+
+    async def resume_md5(self, source, offset, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
+        # md5 state can't be saved, so the persisted bytes are hashed again.
+        md5 = hashlib.md5()
+        position = 0
+        while position < offset:
+            chunk, _ = await source.read(position, min(chunk_size, offset - position))
+            md5.update(chunk)
+            position += len(chunk)
+        return md5
+
+    async def compose_blob(self, bucket, name, sources, content_type=None, metadata=None):
+        request = self.build_request(
+            'POST',
+            self.blob_path(bucket, name, self.COMPOSE_BLOB),
+            json={
+                'sourceObjects': [{'name': source} for source in sources],
+                'destination': dict(metadata or {}, contentType=content_type)
+            }
+        )
+        response = await self.send(request)
+        response.raise_for_status()
+        return Blob(**response.json())
+
+    async def upload_composite(self, bucket, name, source, parts=MAX_COMPOSE_PARTS, content_type=None, 
+        metadata=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY, state=None):
+        # Uploads `parts` slices of a seekable source as temporary objects,
+        # concurrently, then composes them into `name` and deletes the parts.
+        # Part names are stable so a resumed upload reuses finished parts.
+        with UploadSource(source) as whole:
+            size = whole.size
+        parts = max(1, min(parts, MAX_COMPOSE_PARTS))
+        part_size = -(-size // parts) if size else 0
+        part_size = -(-part_size // chunk_size) * chunk_size or chunk_size
+        slices = [(start, min(part_size, size - start)) for start in range(0, size, part_size)] or [(0, 0)]
+        part_names = [f'{name}.part-{index:02d}-of-{len(slices):02d}' for index in range(len(slices))]
+        key = f'{bucket}/{name}'
+        # Finished part names mapped to their crc32c, as reported by GCS.
+        done = dict((state.get(key) or {}).get('done', {})) if state is not None else {}
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def upload_part(index):
+            if part_names[index] in done:
+                return
+            start, length = slices[index]
+            async with semaphore:
+                with UploadSource(source, start, length) as part:
+                    part_blob = await self.upload_resumable(
+                        bucket, part_names[index], part, chunk_size=chunk_size, state=state
+                    )
+            done[part_names[index]] = part_blob.crc32c
+            if state is not None:
+                state.set(key, {'done': done})
+
+        await asyncio.gather(*(upload_part(index) for index in range(len(slices))))
+        blob = await self.compose_blob(bucket, name, part_names, content_type, metadata)
+        # The composite's crc32c must equal the parts' crcs combined in order.
+        if blob.crc32c and all(done.get(part_name) for part_name in part_names):
+            crc = Crc32c()
+            for part_name, (_, length) in zip(part_names, slices):
+                crc.combine(Crc32c(decode_crc32c(done[part_name]), length))
+            check_crc32c(blob, crc.crc)
+        await asyncio.gather(
+            *(self.delete_blob(bucket, part_name) for part_name in part_names),
+            return_exceptions=True
+        )
+        if state is not None:
+            state.discard(key)
+        return blob
+
+    async def upload_blob(self, bucket, name, source, content_type=None, metadata=None, 
+        chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, resume_file=None, composite_threshold=None, 
+        parts=MAX_COMPOSE_PARTS, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        # source is a file path, a bytes-like object or an (async) iterable of
+        # bytes.  resume_file (a path or ResumeState) persists progress for
+        # seekable sources.  Sources of at least composite_threshold bytes are
+        # uploaded as a parallel composite.
+        state = ResumeState(resume_file) if isinstance(resume_file, (str, os.PathLike)) else resume_file
+        with UploadSource(source) as upload_source:
+            if composite_threshold is not None and upload_source.seekable and upload_source.size >= composite_threshold:
+                return await self.upload_composite(
+                    bucket, name, source, parts, content_type, metadata, chunk_size, max_concurrency, state
+                )
+            return await self.upload_resumable(
+                bucket, name, upload_source, content_type, metadata, chunk_size, state
+            )
+
+    async def upload_blobs(self, bucket, uploads, max_concurrency=DEFAULT_BULK_CONCURRENCY, resume_file=None, **kwargs):
+        # uploads is a list or (async) iterable of (name, source) pairs.  Yields
+        # a concurrency.Result per upload, in completion order.
+        state = ResumeState(resume_file) if isinstance(resume_file, (str, os.PathLike)) else resume_file
+        async for result in imap_unordered(
+            lambda upload: self.upload_blob(bucket, *upload, resume_file=state, **kwargs),
+            uploads,
+            max_concurrency=max_concurrency
+        ):
+            yield result
+
+    def rewrite_path(self, bucket, blob, destination_bucket, destination):
+        return self.REWRITE_BLOB.format(
+            bucket=bucket,
+            blob=quote(blob, safe=''),
+            destination_bucket=destination_bucket,
+            destination=quote(destination, safe='')
+        )
+
+    async def rewrite_blob(self, bucket, blob, destination_bucket, destination=None, metadata=None, 
+        max_bytes_per_call=None, state=None, **params):
+        # Server-side copy: GCS moves the bytes, the client never sees them.
+        # Large, cross-location or cross-class copies take several calls
+        # chained by rewriteToken; with state (a ResumeState) the token is
+        # saved after every call so a restarted copy carries on.  A Blob
+        # source pins its generation, which also makes the call retryable.
+        source = blob.name if isinstance(blob, (Blob, BlobRecord)) else blob
+        destination = destination or source
+        generation = blob.generation if isinstance(blob, (Blob, BlobRecord)) else None
+        key = f'rewrite:{bucket}/{source}:{destination_bucket}/{destination}'
+        saved = state.get(key) if state is not None else None
+        token = None
+        if saved and (generation is None or saved.get('generation') == generation):
+            token = saved['token']
+            generation = saved.get('generation')
+        params = dict(params)
+        if generation:
+            params['sourceGeneration'] = generation
+        if max_bytes_per_call:
+            params['maxBytesRewrittenPerCall'] = max_bytes_per_call
+        url = self.rewrite_path(bucket, source, destination_bucket, destination)
+        while True:
+            request = self.build_request(
+                'POST',
+                url,
+                params=dict(params, rewriteToken=token) if token else params,
+                json=dict(metadata or {}),
+                extensions={'idempotent': True} if generation else {}
+            )
+            response = await self.send(request)
+            if response.status_code == 400 and token is not None and saved:
+                # The saved token expired; start the rewrite over.
+                token = saved = None
+                continue
+            response.raise_for_status()
+            result = response.json()
+            if result['done']:
+                if state is not None:
+                    state.discard(key)
+                return Blob(**result['resource'])
+            token = result['rewriteToken']
+            if state is not None:
+                state.set(key, {
+                    'token': token, 
+                    'generation': generation, 
+                    'rewritten': result.get('totalBytesRewritten')
+                })
+
+    async def stream_copy(self, bucket, blob, destination_bucket, destination=None, metadata=None, 
+        destination_client=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
+        # Download piped into a resumable upload, chunk by chunk; memory stays
+        # bounded and the source checksum is verified on the way through.
+        blob = await self.resolve_blob(bucket, blob)
+        destination_client = destination_client or self
+        return await destination_client.upload_blob(
+            destination_bucket,
+            destination or blob.name,
+            self.get_blob(bucket, blob),
+            content_type=blob.contentType,
+            metadata=metadata,
+            chunk_size=chunk_size
+        )
+
+    async def copy_blob(self, bucket, blob, destination_bucket, destination=None, metadata=None, 
+        destination_client=None, fallback=False, state=None, **params):
+        # Copies with rewrite_blob.  Bytes only pass through this process
+        # when destination_client is another client (other credentials or
+        # endpoint), or with fallback=True when GCS refuses the rewrite.
+        if destination_client is not None and destination_client is not self:
+            return await self.stream_copy(bucket, blob, destination_bucket, destination, metadata, destination_client)
+        try:
+            return await self.rewrite_blob(bucket, blob, destination_bucket, destination, metadata, state=state, **params)
+        except HTTPStatusError as error:
+            if not fallback or error.response.status_code not in REWRITE_FALLBACK_STATUSES:
+                raise
+        return await self.stream_copy(bucket, blob, destination_bucket, destination, metadata)
+
+    async def move_blob(self, bucket, blob, destination_bucket, destination=None, **kwargs):
+        # Copy, then delete the source generation that was copied; a source
+        # overwritten in the meantime is left in place.
+        blob = await self.resolve_blob(bucket, blob)
+        copied = await self.copy_blob(bucket, blob, destination_bucket, destination, **kwargs)
+        await self.delete_blob(bucket, blob.name, ifGenerationMatch=blob.generation)
+        return copied
+
+    async def copy_blobs(self, bucket, blobs, destination_bucket, max_concurrency=DEFAULT_BULK_CONCURRENCY, 
+        resume_file=None, move=False, **kwargs):
+        # blobs is a list or (async) iterable of names, Blob models or
+        # (source, destination name) pairs.  Yields a concurrency.Result per
+        # copy, in completion order.  With resume_file (a path or ResumeState),
+        # rewrite tokens are kept there and finished copies next to it in
+        # <path>.done; on a rerun those are skipped and their Result value is
+        # None.
+        state = ResumeState(resume_file) if isinstance(resume_file, (str, os.PathLike)) else resume_file
+        journal = CopyJournal(f'{os.fspath(state.path)}.done') if state is not None else None
+        operation = self.move_blob if move else self.copy_blob
+
+        async def copy(item):
+            source, destination = item if isinstance(item, tuple) else (item, None)
+            name = source.name if isinstance(source, (Blob, BlobRecord)) else source
+            key = (f'{bucket}/{name}', f'{destination_bucket}/{destination or name}')
+            if journal is not None and key in journal:
+                return None
+            blob = await operation(bucket, source, destination_bucket, destination, state=state, **kwargs)
+            if journal is not None:
+                journal.add(key)
+            return blob
+
+        try:
+            async for result in imap_unordered(copy, blobs, max_concurrency=max_concurrency):
+                yield result
+        finally:
+            if journal is not None:
+                journal.close()
+
+    async def iter_sync_entries(self, location):
+        # (name relative to the location, stat or BlobRecord) in name order.
+        if location.bucket is None:
+            async for entry in aiter_items(walk_local(location.path)):
+                yield entry
+            return
+        async for blob in self.iter_blobs(location.bucket, prefix=location.path or None, output='record'):
+            name = blob.name[len(location.path):]
+            # Zero-byte "directory" placeholders have no local counterpart.
+            if name and not name.endswith('/'):
+                yield name, blob
+
+    async def iter_sync_actions(self, source, destination, delete=False, manifest=None):
+        # Merge-joins both sides and yields a sync.SyncAction per difference.
+        # A local file and an object of the same size are equal when the
+        # manifest says neither changed since the last sync, otherwise the
+        # file is hashed (off the loop) against the object's checksum.
+        pair = f'{source} -> {destination}'
+        if source.bucket is None:
+            kind = 'upload'
+        elif destination.bucket is None:
+            kind = 'download'
+        else:
+            kind = 'copy'
+        async for name, src, dst in merge_join(self.iter_sync_entries(source), self.iter_sync_entries(destination)):
+            if src is None:
+                if delete:
+                    yield SyncAction('delete', name, None, dst)
+                continue
+            if dst is not None:
+                if kind == 'copy':
+                    if same_content(src, dst):
+                        continue
+                else:
+                    stat, blob = (src, dst) if kind == 'upload' else (dst, src)
+                    record = manifest.get(pair, name) if manifest is not None else None
+                    same = compare(stat, blob, record)
+                    if same is None:
+                        local = source if kind == 'upload' else destination
+                        same = await asyncio.to_thread(file_matches, os.path.join(local.path, name), blob)
+                        if same and manifest is not None:
+                            manifest.put(pair, name, stat, blob.generation)
+                    if same:
+                        continue
+            yield SyncAction(kind, name, src, dst)
+
+    async def apply_sync_action(self, action, source, destination, manifest=None):
+        pair = f'{source} -> {destination}'
+        kind, name, src, dst = action
+        if kind == 'delete':
+            if destination.bucket is None:
+                os.remove(os.path.join(destination.path, name))
+            else:
+                await self.delete_blob(destination.bucket, destination.path + name, ifGenerationMatch=dst.generation)
+            if manifest is not None:
+                manifest.discard(pair, name)
+            return None
+        if kind == 'copy':
+            return await self.copy_blob(source.bucket, src, destination.bucket, destination.path + name)
+        if kind == 'upload':
+            blob = await self.upload_blob(destination.bucket, destination.path + name, os.path.join(source.path, name))
+            if manifest is not None:
+                manifest.put(pair, name, src, blob.generation)
+            return blob
+        # Downloads land in a temporary file renamed into place, so an
+        # interrupted sync never leaves a truncated file behind.
+        path = os.path.join(destination.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.sync-{os.getpid()}'
+        try:
+            blob = await self.download_blob(source.bucket, src, temp)
+            os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        if manifest is not None:
+            manifest.put(pair, name, os.stat(path), blob.generation)
+        return blob
+
+    async def sync(self, source, destination, delete=False, manifest=None, dry_run=False,
+        max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        # Makes destination match source: local directory to 'gs://bucket/prefix',
+        # the reverse, or bucket to bucket (server-side copies).  Only
+        # differences are transferred, and with delete=True destination
+        # extras are removed.  Both sides are streamed in name order and
+        # merge-joined, so neither is held in memory.  manifest (a path or
+        # sync.SyncManifest) remembers previous runs.  Yields a
+        # concurrency.Result per action, with a sync.SyncAction as its item;
+        # dry_run only yields the actions.
+        source, destination = parse_location(source), parse_location(destination)
+        if source.bucket is None and destination.bucket is None:
+            raise ValueError('sync needs at least one gs:// location')
+        manifest = SyncManifest(manifest) if isinstance(manifest, (str, os.PathLike)) else manifest
+        actions = self.iter_sync_actions(source, destination, delete, manifest)
+        if dry_run:
+            async for action in actions:
+                yield Result(action)
+            return
+        async for result in imap_unordered(
+            lambda action: self.apply_sync_action(action, source, destination, manifest),
+            actions,
+            max_concurrency=max_concurrency
+        ):
+            yield result
+
+
+class StorageClient:
+
+    # Blocking facade over AsyncStorageClient for code without an event loop.
+    # The async client lives on a dedicated background loop thread; coroutine
+    # methods block until done and async generators become plain iterators,
+    # e.g. StorageClient().list_blobs(bucket) or StorageClient().iter_blobs(bucket).
+    def __init__(self, *args, **kwargs):
+        self.loop_thread = LoopThread()
+        self.client = AsyncStorageClient(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name in ('client', 'loop_thread'):
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if inspect.isasyncgenfunction(attribute):
+            return lambda *args, **kwargs: self.loop_thread.iterate(attribute(*args, **kwargs))
+        if inspect.iscoroutinefunction(attribute):
+            return lambda *args, **kwargs: self.loop_thread.run(attribute(*args, **kwargs))
+        return attribute
+
+    def close(self):
+        try:
+            self.loop_thread.run(self.client.close())
+        finally:
+            self.loop_thread.close()
 
-    def get_blob(self):
-        # implement get blob
-        # Using Range header - can we replace this with an iterator / lazy approach instead for streaming?
-        pass
+    def __enter__(self):
+        return self
 
-    def get_blobs(self):
-        # implement get blobs.  Asynchronous Blob getting ... :-p
-        pass
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 if __name__ == '__main__':
-    import json
-    gcs = AsyncStorageClient()
-    buckets = gcs.list_buckets()
-    blobs = gcs.list_blobs('holy-diver-297719-input')
-    bucket = gcs.get_bucket('holy-diver-297719-input')
-    print(bucket)
\ No newline at end of file
+    with StorageClient() as gcs:
+        buckets = gcs.list_buckets()
+        blobs = gcs.list_blobs('holy-diver-297719-input')
+        bucket = gcs.get_bucket('holy-diver-297719-input')
+        print(bucket)
@@ -0,0 +1,138 @@
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from models import parse_timestamp
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Same sentinel numpy uses for NaT, so missing timestamps survive the view.
+MISSING_TIME = -2 ** 63
+MISSING_INT = -1
+COLUMN_FIELDS = 'items(name,size,generation,timeCreated,updated,contentType,storageClass)'
+
+
+def timestamp_us(value):
+    if not value:
+        return MISSING_TIME
+    delta = parse_timestamp(value) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError('numpy is required for NumPy export: pip install numpy')
+    return numpy
+
+
+class DictionaryColumn:
+
+    def __init__(self):
+        self.codes = array('i')
+        self.categories = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        return self.categories[self.codes[position]]
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.categories)
+            self.categories.append(value)
+        self.codes.append(code)
+
+
+class StringColumn:
+
+    # Arrow-style layout: one UTF-8 heap plus int64 end offsets.
+    def __init__(self):
+        self.offsets = array('q', [0])
+        self.data = bytearray()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.data[self.offsets[position]:self.offsets[position + 1]].decode()
+
+    def append(self, value):
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+
+class BlobColumns:
+
+    # Blob listings as typed columns instead of per-object models.  Integers
+    # and timestamps (microseconds since the epoch) are packed int64 arrays,
+    # contentType and storageClass are dictionary-encoded, and names are
+    # split into a dictionary-encoded prefix ("directory") and a basename heap.
+    def __init__(self):
+        self.size = array('q')
+        self.generation = array('q')
+        self.timeCreated = array('q')
+        self.updated = array('q')
+        self.prefix = DictionaryColumn()
+        self.basename = StringColumn()
+        self.contentType = DictionaryColumn()
+        self.storageClass = DictionaryColumn()
+
+    def __len__(self):
+        return len(self.size)
+
+    def name(self, position):
+        return self.prefix[position] + self.basename[position]
+
+    def names(self):
+        return (self.name(position) for position in range(len(self)))
+
+    def append(self, item):
+        name = item['name']
+        split = name.rfind('/') + 1
+        self.prefix.append(name[:split])
+        self.basename.append(name[split:])
+        self.size.append(int(item.get('size', MISSING_INT)))
+        self.generation.append(int(item.get('generation', MISSING_INT)))
+        self.timeCreated.append(timestamp_us(item.get('timeCreated')))
+        self.updated.append(timestamp_us(item.get('updated')))
+        self.contentType.append(item.get('contentType'))
+        self.storageClass.append(item.get('storageClass'))
+
+    def append_page(self, page):
+        for item in page.get('items', ()):
+            self.append(item)
+
+    def to_numpy(self):
+        # Numeric columns are zero-copy views over the packed arrays;
+        # dictionary columns come back as (codes, categories) pairs.
+        np = require_numpy()
+        return {
+            'size': np.frombuffer(self.size, dtype=np.int64),
+            'generation': np.frombuffer(self.generation, dtype=np.int64),
+            'timeCreated': np.frombuffer(self.timeCreated, dtype='datetime64[us]'),
+            'updated': np.frombuffer(self.updated, dtype='datetime64[us]'),
+            'prefix': (np.frombuffer(self.prefix.codes, dtype=np.int32), self.prefix.categories),
+            'contentType': (np.frombuffer(self.contentType.codes, dtype=np.int32), self.contentType.categories),
+            'storageClass': (np.frombuffer(self.storageClass.codes, dtype=np.int32), self.storageClass.categories),
+        }
+
+    def size_by(self, column='prefix'):
+        # Total bytes per category of a dictionary column, e.g. 'prefix' or
+        # 'storageClass'.
+        encoded = getattr(self, column)
+        if numpy is not None:
+            codes = numpy.frombuffer(encoded.codes, dtype=numpy.int32)
+            sizes = numpy.frombuffer(self.size, dtype=numpy.int64).clip(0)
+            totals = numpy.zeros(len(encoded.categories), dtype=numpy.int64)
+            numpy.add.at(totals, codes, sizes)
+            return dict(zip(encoded.categories, totals.tolist()))
+        totals = [0] * len(encoded.categories)
+        for code, size in zip(encoded.codes, self.size):
+            totals[code] += max(size, 0)
+        return dict(zip(encoded.categories, totals))
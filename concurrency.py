@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from typing import Any, NamedTuple, Optional
+
+# Requests in flight for one object (ranges, parts) and for bulk operations
+# over many objects.
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_BULK_CONCURRENCY = 64
+
+
+class Result(NamedTuple):
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+async def aiter_items(items):
+    # Normalizes lists, generators and async iterables into an async iterator.
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _call(func, item):
+    try:
+        return Result(item, await func(item))
+    except Exception as error:
+        return Result(item, error=error)
+
+
+async def imap_unordered(func, items, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+    # Runs func over items with at most max_concurrency calls in flight and
+    # yields a Result per item as each completes.  Items are only pulled from
+    # the source when a slot frees up, so a slow consumer applies backpressure
+    # all the way to the producer.  Failures are returned, never raised.
+    iterator = aiter_items(items).__aiter__()
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max(1, max_concurrency):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(_call(func, item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class LoopThread:
+
+    # An event loop running forever on a daemon thread, for driving async
+    # code from synchronous callers.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def iterate(self, aiterator):
+        # Pulls one item at a time; the loop keeps running between pulls, so
+        # any prefetching inside the iterator carries on in the background.
+        aiterator = aiterator.__aiter__()
+        try:
+            while True:
+                try:
+                    yield self.run(aiterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(aiterator, 'aclose'):
+                self.run(aiterator.aclose())
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,37 @@
+import json
+import os
+
+# Rewrites an endpoint doesn't implement (emulators, some proxies), which a
+# streamed copy can still do.  Permission and validation errors are real
+# refusals and are raised, not streamed around.
+REWRITE_FALLBACK_STATUSES = frozenset({405, 501})
+
+
+class CopyJournal:
+
+    def __init__(self, path):
+        # Append-only record of finished copies, one JSON [source,
+        # destination] line each, so a restarted bulk copy skips them.
+        # Appending keeps checkpointing O(1) per object.
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as src:
+                for line in src:
+                    try:
+                        self.done.add(tuple(json.loads(line)))
+                    except ValueError:
+                        # A torn final line from a crash.
+                        continue
+        self.file = open(path, 'a')
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        self.done.add(key)
+        self.file.write(json.dumps(list(key)) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,176 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import resource_tracker, shared_memory
+
+from clients import AsyncStorageClient
+from concurrency import Result, imap_unordered
+
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_WORKER_CONCURRENCY = 16
+
+# Per-process state, set up once by the pool initializer.
+_worker = None
+
+
+def create_shared_memory(size):
+    # The segment is handed to the parent, which unlinks it; stop this
+    # process's resource tracker from unlinking it when the worker exits.
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size), track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedBlob:
+
+    def __init__(self, name, shm_name, size):
+        self.name = name
+        self.shm_name = shm_name
+        self.size = size
+        self.shm = None
+
+    @property
+    def buffer(self):
+        # Zero-copy view of the worker's output.
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.shm_name)
+        return self.shm.buf[:self.size]
+
+    def close(self):
+        # Frees the segment; views from buffer must be released first.
+        shm = self.shm or shared_memory.SharedMemory(name=self.shm_name)
+        self.shm = None
+        shm.close()
+        shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Worker:
+
+    def __init__(self, client_options, transform, max_concurrency):
+        # Each process has its own loop, connection pool and auth.
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncStorageClient(**client_options)
+        self.transform = transform
+        self.max_concurrency = max_concurrency
+
+    async def fetch(self, bucket, blob):
+        blob = await self.client.resolve_blob(bucket, blob)
+        if self.transform is None:
+            # Straight into shared memory, no intermediate buffer.
+            size = int(blob.size)
+            shm = create_shared_memory(size)
+            view = shm.buf[:size]
+            try:
+                await self.client.download_blob(bucket, blob, view)
+            except BaseException:
+                view.release()
+                shm.close()
+                shm.unlink()
+                raise
+            view.release()
+        else:
+            data = self.transform(await self.client.read_blob(bucket, blob))
+            size = len(data)
+            shm = create_shared_memory(size)
+            shm.buf[:size] = data
+        shm_name = shm.name
+        shm.close()
+        return SharedBlob(blob.name, shm_name, size)
+
+    async def fetch_batch(self, bucket, blobs):
+        return [
+            result if result.ok else Result(result.item, error=portable_error(result.error))
+            async for result in imap_unordered(
+                lambda blob: self.fetch(bucket, blob),
+                blobs,
+                max_concurrency=self.max_concurrency
+            )
+        ]
+
+
+def portable_error(error):
+    # Exceptions cross back to the parent by pickle; not all of them survive.
+    import pickle
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+def _init_worker(client_options, transform, max_concurrency):
+    global _worker
+    _worker = _Worker(client_options, transform, max_concurrency)
+
+
+def _fetch_batch(bucket, blobs):
+    return _worker.loop.run_until_complete(_worker.fetch_batch(bucket, blobs))
+
+
+class ProcessDownloadExecutor:
+
+    def __init__(self, processes=None, client_options=None, transform=None,
+        batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_WORKER_CONCURRENCY):
+        # Spreads downloads over a process pool so CPU-bound post-processing
+        # (transform, e.g. gzip.decompress) scales past one core.  Each worker
+        # runs its own AsyncStorageClient(**client_options) with up to
+        # max_concurrency downloads in flight; transform must be picklable
+        # and return a bytes-like object.  Results come back in shared memory.
+        self.processes = processes or os.cpu_count()
+        self.batch_size = batch_size
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_worker,
+            initargs=(client_options or {}, transform, max_concurrency)
+        )
+
+    def map(self, bucket, blobs):
+        # blobs is an iterable of names or Blob models.  Yields a
+        # concurrency.Result per blob, in completion order, whose value is a
+        # SharedBlob; the caller closes it once done with the buffer.
+        blobs = list(blobs)
+        futures = [
+            self.pool.submit(_fetch_batch, bucket, blobs[start:start + self.batch_size])
+            for start in range(0, len(blobs), self.batch_size)
+        ]
+        done = set()
+        unclaimed = deque()
+        try:
+            for future in as_completed(futures):
+                done.add(future)
+                unclaimed.extend(future.result())
+                while unclaimed:
+                    yield unclaimed.popleft()
+        finally:
+            # Segments are only freed by close(); when the caller stops early,
+            # wait out the batches that can't be cancelled and free every
+            # segment nobody received.
+            for future in futures:
+                if future in done or future.cancel():
+                    continue
+                try:
+                    unclaimed.extend(future.result())
+                except Exception:
+                    continue
+            for result in unclaimed:
+                if result.ok:
+                    result.value.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,570 @@
+import asyncio
+import base64
+import bisect
+import email
+import hashlib
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+
+from httpx import MockTransport, Request, Response
+
+from checksums import crc32c, encode_crc32c, encode_md5
+
+PROJECT_ID = 'fake-project'
+PROJECT_NUMBER = '123456789012'
+SERVICE_ACCOUNT = f'fake@{PROJECT_ID}.iam.gserviceaccount.com'
+STORAGE_HOST = 'https://storage.googleapis.com'
+DEFAULT_TOKEN_TTL = 3600
+DEFAULT_PAGE_SIZE = 1000
+
+ROUTES = [
+    (re.compile(pattern), name)
+    for pattern, name in (
+        (r'^/storage/v1/b$', 'buckets'),
+        (r'^/storage/v1/b/([^/]+)$', 'bucket'),
+        (r'^/storage/v1/b/([^/]+)/o$', 'objects'),
+        (r'^/storage/v1/b/([^/]+)/o/([^/]+)$', 'object'),
+        (r'^/storage/v1/b/([^/]+)/o/([^/]+)/compose$', 'compose'),
+        (r'^/storage/v1/b/([^/]+)/o/([^/]+)/rewriteTo/b/([^/]+)/o/([^/]+)$', 'rewrite'),
+        (r'^/download/storage/v1/b/([^/]+)/o/([^/]+)$', 'media'),
+        (r'^/upload/storage/v1/b/([^/]+)/o$', 'upload'),
+        (r'^/batch/storage/v1$', 'batch'),
+    )
+]
+
+
+def timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def error(status, message):
+    return Response(status, json={'error': {'code': status, 'message': message}})
+
+
+def fake_jwt(claims):
+    encode = lambda part: base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b'=').decode()
+    return f'{encode({"alg": "none", "typ": "JWT"})}.{encode(claims)}.'
+
+
+class Throttle:
+
+    def __init__(self, rate, burst=None):
+        # Token bucket: rate requests per second, bursts up to burst.
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBucket:
+
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+        self.names = []
+        self.metadata = {
+            'kind': 'storage#bucket',
+            'id': name,
+            'name': name,
+            'projectNumber': PROJECT_NUMBER,
+            'metageneration': '1',
+            'location': 'US',
+            'storageClass': 'STANDARD',
+            'etag': 'CAE=',
+            'timeCreated': timestamp(),
+            'updated': timestamp()
+        }
+
+    def put(self, name, resource, data):
+        if name not in self.objects:
+            bisect.insort(self.names, name)
+        self.objects[name] = (resource, data)
+
+    def delete(self, name):
+        del self.objects[name]
+        del self.names[bisect.bisect_left(self.names, name)]
+
+
+class FakeGCS:
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0, error_status=503,
+        rate_limit=None, token_latency=0.0, token_ttl=DEFAULT_TOKEN_TTL, require_auth=False, seed=None):
+        # An in-process stand-in for the JSON API and the metadata server,
+        # served through httpx.MockTransport.  Every storage request waits
+        # latency seconds plus an exponential jitter with that mean, media
+        # additionally size / bandwidth seconds.  error_rate of requests fail
+        # with error_status, and past rate_limit requests per second they get
+        # 429s.  With require_auth, requests need a token the fake issued.
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle = Throttle(rate_limit) if rate_limit else None
+        self.token_latency = token_latency
+        self.token_ttl = token_ttl
+        self.require_auth = require_auth
+        self.random = random.Random(seed)
+        self.buckets = {}
+        self.sessions = {}
+        self.tokens = set()
+        self.failures = []
+        self.generations = itertools.count(int(time.time() * 1000000))
+        self.token_ids = itertools.count(1)
+        self.stats = Counter()
+
+    # Seeding and scripting.
+
+    def add_bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+    def put(self, bucket, name, data, content_type='application/octet-stream', metadata=None, composite=False):
+        data = bytes(data)
+        bucket = self.add_bucket(bucket)
+        generation = str(next(self.generations))
+        now = timestamp()
+        resource = {
+            'kind': 'storage#object',
+            'id': f'{bucket.name}/{name}/{generation}',
+            'selfLink': f'{STORAGE_HOST}/storage/v1/b/{bucket.name}/o/{quote(name, safe="")}',
+            'mediaLink': f'{STORAGE_HOST}/download/storage/v1/b/{bucket.name}/o/{quote(name, safe="")}'
+                f'?generation={generation}&alt=media',
+            'name': name,
+            'bucket': bucket.name,
+            'generation': generation,
+            'metageneration': '1',
+            'contentType': content_type,
+            'storageClass': 'STANDARD',
+            'size': str(len(data)),
+            'crc32c': encode_crc32c(crc32c(data)),
+            'etag': base64.b64encode(generation.encode()).decode(),
+            'timeCreated': now,
+            'updated': now
+        }
+        # Composite objects carry no md5Hash.
+        if not composite:
+            resource['md5Hash'] = encode_md5(hashlib.md5(data).digest())
+        if metadata:
+            resource['metadata'] = dict(metadata)
+        bucket.put(name, resource, data)
+        return resource
+
+    def get(self, bucket, name):
+        return self.buckets[bucket].objects[name][1]
+
+    def fail_next(self, count=1, status=503, match=None):
+        # The next count storage requests whose URL contains match fail.
+        self.failures.extend([(status, match)] * count)
+
+    def revoke_tokens(self):
+        # Every issued token is rejected from now on, as after a rotation.
+        self.tokens.clear()
+
+    # Transports.
+
+    def transport(self):
+        return MockTransport(self.handle)
+
+    def metadata_transport(self, asynchronous=False):
+        # Works for both Metadata and AsyncMetadata; the async flavour waits
+        # token_latency without blocking the loop.
+        if asynchronous:
+            return MockTransport(self.ahandle_metadata)
+        return MockTransport(self.handle_metadata)
+
+    def storage_client(self, **kwargs):
+        # An AsyncStorageClient wired to this fake, auth included.
+        from auth_v2 import MetadataAuth
+        from clients import AsyncStorageClient, build_client
+        from metadata_v2 import AsyncMetadata, Metadata
+
+        async_metadata = AsyncMetadata(transport=self.metadata_transport(asynchronous=True))
+        kwargs.setdefault('project_id', PROJECT_ID)
+        kwargs.setdefault('metadata', async_metadata)
+        kwargs.setdefault('client', build_client(transport=self.transport()))
+        client = AsyncStorageClient(**kwargs)
+        client.auth = MetadataAuth(
+            service_account=kwargs.get('service_account', 'default'),
+            metadata=Metadata(transport=self.metadata_transport()),
+            async_metadata=async_metadata
+        )
+        return client
+
+    # Metadata server.
+
+    def handle_metadata(self, request):
+        if request.headers.get('Metadata-Flavor') != 'Google':
+            return Response(403, text='Missing Metadata-Flavor:Google header.')
+        path = request.url.path[len('/computeMetadata/v1/'):]
+        account = re.match(r'^instance/service-accounts/([^/]+)/(token|identity)$', path)
+        if path == '':
+            return Response(200, json=self.metadata_tree())
+        if path == 'project/project-id':
+            return Response(200, json=PROJECT_ID)
+        if path == 'project/numeric-project-id':
+            return Response(200, json=int(PROJECT_NUMBER))
+        if account is None:
+            return Response(404, text='Not found')
+        self.stats['metadata.token'] += 1
+        now = int(time.time())
+        if account[2] == 'identity':
+            audience = request.url.params.get('audience')
+            if not audience:
+                return Response(400, text='audience is required')
+            claims = {'aud': audience, 'email': SERVICE_ACCOUNT, 'iat': now, 'exp': now + self.token_ttl}
+            return Response(200, text=fake_jwt(claims))
+        token = f'fake-token-{next(self.token_ids)}'
+        self.tokens.add(token)
+        return Response(200, json={'access_token': token, 'expires_in': self.token_ttl, 'token_type': 'Bearer'})
+
+    async def ahandle_metadata(self, request):
+        if self.token_latency and '/service-accounts/' in request.url.path:
+            await asyncio.sleep(self.token_latency)
+        return self.handle_metadata(request)
+
+    def metadata_tree(self):
+        account = {'email': SERVICE_ACCOUNT, 'aliases': ['default'], 'scopes': ['https://www.googleapis.com/auth/cloud-platform']}
+        return {
+            'project': {'projectId': PROJECT_ID, 'numericProjectId': int(PROJECT_NUMBER)},
+            'instance': {'serviceAccounts': {'default': account, SERVICE_ACCOUNT: account}}
+        }
+
+    # Storage.
+
+    async def handle(self, request):
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.expovariate(1 / self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        injected = self.inject(request)
+        if injected is not None:
+            return injected
+        response = self.route(request)
+        if self.bandwidth and request.method == 'GET' and response.status_code in (200, 206):
+            await asyncio.sleep(len(response.content) / self.bandwidth)
+        return response
+
+    def inject(self, request):
+        for index, (status, match) in enumerate(self.failures):
+            if match is None or match in str(request.url):
+                del self.failures[index]
+                self.stats[f'injected.{status}'] += 1
+                return error(status, 'Injected failure')
+        if self.throttle is not None and not self.throttle.take():
+            self.stats['throttled'] += 1
+            return Response(429, headers={'Retry-After': '1'}, json={'error': {'code': 429, 'message': 'Rate limited'}})
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats[f'injected.{self.error_status}'] += 1
+            return error(self.error_status, 'Injected failure')
+        if self.require_auth:
+            token = request.headers.get('Authorization', '').partition('Bearer ')[2]
+            if token not in self.tokens:
+                self.stats['unauthorized'] += 1
+                return error(401, 'Invalid Credentials')
+        return None
+
+    def route(self, request):
+        path = request.url.raw_path.decode().partition('?')[0]
+        for pattern, name in ROUTES:
+            match = pattern.match(path)
+            if match is not None:
+                self.stats[f'{request.method} {name}'] += 1
+                try:
+                    return getattr(self, f'handle_{name}')(request, *map(unquote, match.groups()))
+                except KeyError as exc:
+                    return error(404, f'No such object: {exc.args[0]}')
+        return error(404, f'Not found: {path}')
+
+    def lookup(self, bucket, name):
+        return self.buckets[bucket].objects[name]
+
+    def precondition(self, request, resource):
+        # GCS precondition semantics; resource is None for a missing object.
+        # Buckets only have metagenerations and etags.
+        params = request.url.params
+        generation = resource.get('generation', '0') if resource else '0'
+        metageneration = resource['metageneration'] if resource else None
+        if 'ifGenerationMatch' in params and params['ifGenerationMatch'] != generation:
+            return error(412, 'Precondition Failed')
+        if 'ifMetagenerationMatch' in params and params['ifMetagenerationMatch'] != metageneration:
+            return error(412, 'Precondition Failed')
+        if 'ifGenerationNotMatch' in params and params['ifGenerationNotMatch'] == generation:
+            return Response(304) if request.method == 'GET' else error(412, 'Precondition Failed')
+        if 'ifMetagenerationNotMatch' in params and params['ifMetagenerationNotMatch'] == metageneration:
+            return Response(304) if request.method == 'GET' else error(412, 'Precondition Failed')
+        if resource and request.headers.get('If-None-Match') == resource['etag']:
+            return Response(304)
+        return None
+
+    def handle_buckets(self, request):
+        params = request.url.params
+        names = sorted(name for name in self.buckets if name.startswith(params.get('prefix', '')))
+        start = int(params.get('pageToken', 0))
+        size = int(params.get('maxResults', DEFAULT_PAGE_SIZE))
+        page = {'kind': 'storage#buckets', 'items': [self.buckets[name].metadata for name in names[start:start + size]]}
+        if start + size < len(names):
+            page['nextPageToken'] = str(start + size)
+        return Response(200, json=page)
+
+    def handle_bucket(self, request, bucket):
+        resource = self.buckets[bucket].metadata
+        return self.precondition(request, resource) or Response(200, json=resource)
+
+    def handle_objects(self, request, bucket):
+        # Name order, with prefix, delimiter, startOffset/endOffset and pages
+        # of maxResults items and prefixes together, like the real listing.
+        params = request.url.params
+        bucket = self.buckets[bucket]
+        prefix = params.get('prefix', '')
+        delimiter = params.get('delimiter')
+        size = int(params.get('maxResults', DEFAULT_PAGE_SIZE))
+        after = params.get('pageToken')
+        start = max(filter(None, (prefix, params.get('startOffset'))), default='')
+        end = params.get('endOffset')
+        names = bucket.names
+        index = bisect.bisect_right(names, base64.b64decode(after).decode()) if after else bisect.bisect_left(names, start)
+        items, prefixes = [], []
+        last = None
+        while index < len(names) and len(items) + len(prefixes) < size:
+            name = names[index]
+            if not name.startswith(prefix) or (end is not None and name >= end):
+                break
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+                prefixes.append(common)
+                # Skip the rest of the group.
+                index = bisect.bisect_left(names, common + '\U0010ffff')
+                last = names[index - 1]
+                continue
+            items.append(bucket.objects[name][0])
+            last = name
+            index += 1
+        page = {'kind': 'storage#objects', 'items': items}
+        if prefixes:
+            page['prefixes'] = prefixes
+        more = index < len(names) and names[index].startswith(prefix) and (end is None or names[index] < end)
+        if more:
+            page['nextPageToken'] = base64.b64encode(last.encode()).decode()
+        return Response(200, json=self.project(page, params.get('fields')))
+
+    def project(self, page, fields):
+        # A rough `fields` projection: items(a,b) keeps those item keys.
+        if not fields:
+            return page
+        match = re.search(r'items\(([^)]*)\)', fields)
+        if match is not None:
+            keep = set(match[1].split(','))
+            page['items'] = [{key: value for key, value in item.items() if key in keep} for item in page['items']]
+        return page
+
+    def handle_object(self, request, bucket, name):
+        objects = self.buckets[bucket].objects
+        resource = objects[name][0] if name in objects else None
+        if resource is None:
+            return error(404, f'No such object: {bucket}/{name}')
+        failed = self.precondition(request, resource)
+        if failed is not None:
+            return failed
+        if request.url.params.get('alt') == 'media':
+            return self.media(request, bucket, name)
+        if request.method == 'GET':
+            return Response(200, json=resource)
+        if request.method == 'DELETE':
+            self.buckets[bucket].delete(name)
+            return Response(204)
+        if request.method == 'PATCH':
+            patch = json.loads(request.content or b'{}')
+            resource = dict(resource)
+            metadata = dict(resource.get('metadata') or {})
+            metadata.update(patch.pop('metadata', None) or {})
+            resource.update(patch)
+            if metadata:
+                resource['metadata'] = {key: value for key, value in metadata.items() if value is not None}
+            resource['metageneration'] = str(int(resource['metageneration']) + 1)
+            resource['updated'] = timestamp()
+            self.buckets[bucket].put(name, resource, objects[name][1])
+            return Response(200, json=resource)
+        return error(405, 'Method not allowed')
+
+    def handle_media(self, request, bucket, name):
+        objects = self.buckets[bucket].objects
+        if name not in objects:
+            return error(404, f'No such object: {bucket}/{name}')
+        generation = request.url.params.get('generation')
+        if generation and generation != objects[name][0]['generation']:
+            return error(404, f'No such object: {bucket}/{name}#{generation}')
+        return self.media(request, bucket, name)
+
+    def media(self, request, bucket, name):
+        resource, data = self.lookup(bucket, name)
+        hashes = f'crc32c={resource["crc32c"]}'
+        if 'md5Hash' in resource:
+            hashes += f',md5={resource["md5Hash"]}'
+        headers = {
+            'Content-Type': resource['contentType'],
+            'X-Goog-Generation': resource['generation'],
+            'X-Goog-Hash': hashes,
+            'ETag': resource['etag']
+        }
+        ranged = re.match(r'bytes=(\d+)-(\d*)$', request.headers.get('Range', ''))
+        if ranged is None:
+            self.stats['bytes.out'] += len(data)
+            return Response(200, headers=headers, content=data)
+        start = int(ranged[1])
+        end = min(int(ranged[2]) if ranged[2] else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            return Response(416, headers={'Content-Range': f'bytes */{len(data)}'})
+        headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+        self.stats['bytes.out'] += end + 1 - start
+        return Response(206, headers=headers, content=data[start:end + 1])
+
+    def handle_upload(self, request, bucket):
+        params = request.url.params
+        self.add_bucket(bucket)
+        if request.method == 'POST' and params.get('uploadType') == 'resumable':
+            body = json.loads(request.content or b'{}')
+            upload_id = f'upload-{next(self.token_ids)}'
+            self.sessions[upload_id] = {
+                'bucket': bucket,
+                'name': body.get('name') or params.get('name'),
+                'contentType': request.headers.get('X-Upload-Content-Type') or body.get('contentType'),
+                'metadata': body.get('metadata'),
+                'params': dict(params),
+                'data': bytearray()
+            }
+            location = f'{STORAGE_HOST}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}'
+            return Response(200, headers={'Location': location})
+        if request.method == 'POST' and params.get('uploadType') == 'media':
+            objects = self.buckets[bucket].objects
+            name = params['name']
+            failed = self.precondition(request, objects[name][0] if name in objects else None)
+            if failed is not None:
+                return failed
+            content_type = request.headers.get('Content-Type', 'application/octet-stream')
+            self.stats['bytes.in'] += len(request.content)
+            return Response(200, json=self.put(bucket, name, request.content, content_type))
+        if request.method == 'PUT' and 'upload_id' in params:
+            return self.upload_chunk(request, params['upload_id'])
+        return error(400, 'Unsupported upload')
+
+    def upload_chunk(self, request, upload_id):
+        session = self.sessions.get(upload_id)
+        if session is None:
+            return error(404, 'No such upload session')
+        data = session['data']
+        ranged = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$', request.headers.get('Content-Range', ''))
+        if ranged is None:
+            return error(400, 'Bad Content-Range')
+        total = None if ranged[3] == '*' else int(ranged[3])
+        if ranged[1] is not None:
+            if int(ranged[1]) != len(data):
+                return error(400, f'Expected offset {len(data)}')
+            data += request.content
+            self.stats['bytes.in'] += len(request.content)
+        if total is None or len(data) < total:
+            headers = {'Range': f'bytes=0-{len(data) - 1}'} if data else {}
+            return Response(308, headers=headers)
+        hashes = dict(
+            part.strip().split('=', 1)
+            for part in request.headers.get('X-Goog-Hash', '').split(',')
+            if '=' in part
+        )
+        if 'crc32c' in hashes and hashes['crc32c'] != encode_crc32c(crc32c(data)):
+            del self.sessions[upload_id]
+            return error(400, 'Provided CRC32C does not match the uploaded data')
+        if 'md5' in hashes and hashes['md5'] != encode_md5(hashlib.md5(data).digest()):
+            del self.sessions[upload_id]
+            return error(400, 'Provided MD5 hash does not match the uploaded data')
+        del self.sessions[upload_id]
+        resource = self.put(
+            session['bucket'], session['name'], data,
+            session['contentType'] or 'application/octet-stream', session['metadata']
+        )
+        return Response(200, json=resource)
+
+    def handle_compose(self, request, bucket, name):
+        body = json.loads(request.content)
+        sources = body.get('sourceObjects', [])
+        if not 1 <= len(sources) <= 32:
+            return error(400, 'Between 1 and 32 source objects are required')
+        data = b''.join(self.lookup(bucket, source['name'])[1] for source in sources)
+        destination = body.get('destination') or {}
+        return Response(200, json=self.put(
+            bucket, name, data,
+            destination.get('contentType') or 'application/octet-stream',
+            destination.get('metadata'),
+            composite=True
+        ))
+
+    def handle_rewrite(self, request, bucket, name, destination_bucket, destination):
+        # Copies in maxBytesRewrittenPerCall steps when asked to, handing back
+        # a rewriteToken until done, like a large cross-location rewrite.
+        params = request.url.params
+        resource, data = self.lookup(bucket, name)
+        objects = self.add_bucket(destination_bucket).objects
+        failed = self.precondition(request, objects[destination][0] if destination in objects else None)
+        if failed is not None:
+            return failed
+        step = int(params.get('maxBytesRewrittenPerCall', 0)) or len(data)
+        done = int(params['rewriteToken']) if params.get('rewriteToken') else 0
+        done = min(len(data), done + step)
+        result = {
+            'kind': 'storage#rewriteResponse',
+            'totalBytesRewritten': str(done),
+            'objectSize': str(len(data)),
+            'done': done >= len(data)
+        }
+        if not result['done']:
+            result['rewriteToken'] = str(done)
+            return Response(200, json=result)
+        overrides = json.loads(request.content or b'{}')
+        result['resource'] = self.put(
+            destination_bucket, destination, data,
+            overrides.get('contentType') or resource['contentType'],
+            overrides.get('metadata', resource.get('metadata'))
+        )
+        return Response(200, json=result)
+
+    def handle_batch(self, request):
+        # Each part is dispatched as if sent on its own, minus latency.
+        message = email.message_from_bytes(
+            b'Content-Type: ' + request.headers['Content-Type'].encode() + b'\r\n\r\n' + request.content
+        )
+        boundary = 'batch_fake'
+        body = bytearray()
+        for part in message.get_payload():
+            head, _, content = part.get_payload(decode=True).partition(b'\r\n\r\n')
+            lines = head.decode().splitlines()
+            method, target, _ = lines[0].split(' ')
+            headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            headers['Authorization'] = request.headers.get('Authorization', '')
+            headers.pop('Content-Length', None)
+            inner = Request(method, STORAGE_HOST + target, headers=headers, content=content.rstrip(b'\r\n'))
+            response = self.inject(inner) or self.route(inner)
+            body += (
+                f'--{boundary}\r\n'
+                'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{part.get("Content-ID", "").strip("<>")}>\r\n\r\n'
+                f'HTTP/1.1 {response.status_code} {response.reason_phrase}\r\n'
+                f'Content-Type: {response.headers.get("Content-Type", "application/json")}\r\n'
+                f'Content-Length: {len(response.content)}\r\n\r\n'
+            ).encode() + response.content + b'\r\n'
+        body += f'--{boundary}--\r\n'.encode()
+        return Response(200, headers={'Content-Type': f'multipart/mixed; boundary={boundary}'}, content=bytes(body))
@@ -0,0 +1,229 @@
+import json
+import logging
+import math
+import threading
+import time
+
+# The active Recorder, or None.  Hooks check this one global and do nothing
+# else while instrumentation is disabled.
+recorder = None
+
+# Timings are kept in integer microseconds.
+TIME_SCALE = 1000000
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+# Connection setup phases reported by the httpcore trace extension.
+CONNECT_PHASES = ('connection.connect_tcp', 'connection.start_tls')
+
+
+def enable(new_recorder=None):
+    global recorder
+    recorder = new_recorder or Recorder()
+    return recorder
+
+
+def disable():
+    global recorder
+    previous, recorder = recorder, None
+    return previous
+
+
+class Histogram:
+
+    def __init__(self, scale=1, precision_bits=7):
+        # HDR-style log-linear buckets: values below 2**precision_bits are
+        # exact, larger ones keep precision_bits significant bits (under 1%
+        # relative error at the default), so memory grows with log(max).
+        self.scale = scale
+        self.precision_bits = precision_bits
+        self.half = 1 << (precision_bits - 1)
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        shift = max(0, value.bit_length() - self.precision_bits)
+        return shift * self.half + (value >> shift)
+
+    def lower_bound(self, index):
+        if index < 2 * self.half:
+            return index
+        shift = (index - 2 * self.half) // self.half + 1
+        return (index - shift * self.half) << shift
+
+    def unscale(self, value):
+        return value / self.scale if self.scale != 1 else value
+
+    def record(self, value):
+        value = max(0, int(value * self.scale))
+        index = self.index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                middle = (self.lower_bound(index) + self.lower_bound(index + 1) - 1) // 2
+                return self.unscale(min(self.max, max(self.min, middle)))
+        return self.unscale(self.max)
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'min': self.unscale(self.min),
+            'max': self.unscale(self.max),
+            'mean': self.total / self.count / self.scale,
+            'sum': self.unscale(self.total)
+        }
+        for q in PERCENTILES:
+            summary[f'p{q * 100:g}'] = self.percentile(q)
+        return summary
+
+
+def metric_key(metric, operation=None):
+    return f'{metric}[{operation}]' if operation else metric
+
+
+class Recorder:
+
+    def __init__(self, sinks=()):
+        # sinks are callables that receive each exported snapshot.
+        self.sinks = list(sinks)
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def histogram(self, metric, operation=None, scale=1):
+        key = metric_key(metric, operation)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(scale)
+        return histogram
+
+    def timing(self, metric, seconds, operation=None):
+        with self.lock:
+            self.histogram(metric, operation, TIME_SCALE).record(seconds)
+
+    def observe(self, metric, value, operation=None):
+        with self.lock:
+            self.histogram(metric, operation).record(value)
+
+    def count(self, metric, value=1, operation=None):
+        key = metric_key(metric, operation)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'elapsed': time.monotonic() - self.started,
+                'histograms': {key: histogram.summary() for key, histogram in self.histograms.items()},
+                'counters': dict(self.counters)
+            }
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.monotonic()
+
+    def export(self, reset=False):
+        snapshot = self.snapshot()
+        if reset:
+            self.reset()
+        for sink in self.sinks:
+            sink(snapshot)
+        return snapshot
+
+
+class LogSink:
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def __call__(self, snapshot):
+        self.logger.log(self.level, 'storage metrics %s', json.dumps(snapshot, sort_keys=True))
+
+
+class JsonLinesSink:
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, snapshot):
+        with open(self.path, 'a') as dest:
+            dest.write(json.dumps(dict(snapshot, time=time.time()), sort_keys=True) + '\n')
+
+
+def operation_name(request):
+    # A low-cardinality label: method plus the kind of endpoint.
+    if 'operation' in request.extensions:
+        return request.extensions['operation']
+    path = request.url.path
+    if path.startswith('/upload/'):
+        kind = 'upload'
+    elif path.startswith('/batch/'):
+        kind = 'batch'
+    elif request.url.params.get('alt') == 'media' or path.startswith('/download/'):
+        kind = 'media'
+    else:
+        kind = 'json'
+    return f'{request.method} {kind}'
+
+
+async def mark_dispatched(request):
+    # httpx request hook: runs after auth, just before the pool is asked for
+    # a connection.
+    if recorder is not None:
+        request.extensions['dispatched'] = time.monotonic()
+
+
+def trace_request(request, operation):
+    # Installs an httpcore trace callback recording how long the request
+    # waited for a pooled connection and how long new connections took.
+    # Pool wait needs the mark_dispatched hook that build_client installs.
+    state = {'dispatched': None, 'started': {}}
+
+    async def trace(event, info):
+        active = recorder
+        if active is None:
+            return
+        now = time.monotonic()
+        dispatched = request.extensions.get('dispatched')
+        if dispatched is not None and dispatched != state['dispatched']:
+            state['dispatched'] = dispatched
+            active.timing('pool.wait', now - dispatched, operation)
+        phase, _, stage = event.rpartition('.')
+        if phase in CONNECT_PHASES:
+            if stage == 'started':
+                state['started'][phase] = now
+            elif stage == 'complete' and phase in state['started']:
+                active.timing(phase, now - state['started'].pop(phase), operation)
+
+    request.extensions['trace'] = trace
@@ -0,0 +1,120 @@
+import codecs
+import json
+import re
+
+# orjson parses whole documents several times faster than json when it is
+# installed.  It can't resume mid-buffer, so incremental parsing below always
+# uses the stdlib's C scanner.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+    loads = orjson.loads
+else:
+    JSON_BACKEND = 'json'
+    loads = json.loads
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class PageParser:
+
+    def __init__(self, array_key='items'):
+        # Parses a listing page, {"kind": ..., "nextPageToken": ...,
+        # "prefixes": [...], "items": [{...}, ...]}, as its bytes arrive.
+        # feed returns the elements of array_key completed so far; every other
+        # top-level key lands in page as soon as its value is complete, so a
+        # nextPageToken sent ahead of the items is available early.
+        self.array_key = array_key
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.scanner = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.key = None
+        self.page = {}
+
+    def skip(self):
+        self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def value(self, final):
+        # A value only counts once something follows it: a number at the end
+        # of the buffer may still have digits to come.
+        try:
+            value, end = self.scanner.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        if end >= len(self.buffer) and not final:
+            return False, None
+        self.pos = end
+        return True, value
+
+    def feed(self, data, final=False):
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(data, final)
+        self.pos = 0
+        items = []
+        while True:
+            char = self.skip()
+            if not char:
+                break
+            if self.state == 'start':
+                if char != '{':
+                    raise json.JSONDecodeError('Expected a JSON object', self.buffer, self.pos)
+                self.pos += 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if char == '}':
+                    self.pos += 1
+                    self.state = 'done'
+                elif char == ',':
+                    self.pos += 1
+                else:
+                    complete, key = self.value(final)
+                    if not complete:
+                        break
+                    self.key = key
+                    self.state = 'colon'
+            elif self.state == 'colon':
+                if char != ':':
+                    raise json.JSONDecodeError('Expected ":"', self.buffer, self.pos)
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.key == self.array_key and char == '[':
+                    self.pos += 1
+                    self.page[self.key] = []
+                    self.state = 'array'
+                    continue
+                complete, value = self.value(final)
+                if not complete:
+                    break
+                self.page[self.key] = value
+                self.state = 'key'
+            elif self.state == 'array':
+                if char == ']':
+                    self.pos += 1
+                    self.state = 'key'
+                elif char == ',':
+                    self.pos += 1
+                else:
+                    complete, item = self.value(final)
+                    if not complete:
+                        break
+                    items.append(item)
+            else:
+                raise json.JSONDecodeError('Extra data', self.buffer, self.pos)
+        return items
+
+    def close(self):
+        # Flushes the decoder and returns any items still pending; raises if
+        # the page was cut short.
+        items = self.feed(b'', final=True)
+        if self.state != 'done':
+            raise json.JSONDecodeError('Truncated listing page', self.buffer, self.pos)
+        return items
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 100000
+# Eviction runs every EVICT_INTERVAL writes rather than on every put.
+EVICT_INTERVAL = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    etag TEXT,
+    metageneration TEXT,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+'''
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    etag: Optional[str]
+    metageneration: Optional[str]
+    stored_at: float
+
+
+class MetadataCache:
+
+    def __init__(self, path=':memory:', ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        # Bucket/object metadata and listing pages in SQLite.  Entries younger
+        # than ttl are served as is; older ones are revalidated with a
+        # conditional request.  The least recently read entries are evicted
+        # beyond max_entries.  A file path lets processes share the cache.
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(SCHEMA)
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+
+    def close(self):
+        self.db.close()
+
+    def fresh(self, entry):
+        return time.time() - entry.stored_at < self.ttl
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT value, etag, metageneration, stored_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        value, etag, metageneration, stored_at = row
+        return CacheEntry(json.loads(value), etag, metageneration, stored_at)
+
+    def put(self, key, value, etag=None, metageneration=None):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, json.dumps(value), etag, metageneration, now, now)
+            )
+            self.writes += 1
+            if self.writes % EVICT_INTERVAL == 0:
+                self.evict()
+
+    def revalidated(self, key):
+        # A 304 confirmed the entry; restart its ttl.
+        now = time.time()
+        with self.lock:
+            self.db.execute('UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+
+    def discard(self, key):
+        with self.lock:
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def evict(self):
+        (count,) = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()
+        if count > self.max_entries:
+            self.db.execute(
+                'DELETE FROM entries WHERE key IN '
+                '(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,)
+            )
@@ -1,4 +1,15 @@
-from httpx import Client, Request
+import asyncio
+import threading
+import weakref
+from httpx import AsyncClient, Client, Request
+from auth_models import MetadataToken
+from tokens import identity_tokens
+
+# Snapshot of the recursive metadata tree, shared by every Metadata and
+# AsyncMetadata in the process.  Project and instance identity never change
+# for the life of a process, so one fetch serves all of them.
+_TREE = {}
+_TREE_LOCK = threading.Lock()
 
 
 class Metadata:
@@ -6,31 +17,56 @@ class Metadata:
     BASE_URL = 'http://metadata.google.internal/computeMetadata/v1/'
     HEADERS = {'Metadata-Flavor': 'Google'}
     PARAMS = {'alt': 'json'}
+    ROOT = ''
     PROJECT_ID = 'project/project-id'
     PROJECT_NUMBER = 'project/numeric-project-id'
     TOKEN = 'instance/service-accounts/{service_account}/token'
     IDENTITY = 'instance/service-accounts/{service_account}/identity'
     RECURSIVE = {'recursive': 'true'}
+    WAIT_TIMEOUT = 60
+
+    _shared = None
+    _shared_lock = threading.Lock()
 
-    def __init__(self):
+    def __init__(self, transport=None):
         self.client = Client(
             base_url=self.BASE_URL,
             headers=self.HEADERS,
-            params=self.PARAMS
+            params=self.PARAMS,
+            transport=transport
         )
 
     def __del__(self):
         self.client.close()
-    
+
+    @classmethod
+    def shared(cls):
+        # One pooled client per process.
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def tree_request(self):
+        return self.client.build_request('GET', self.ROOT, params=self.RECURSIVE)
+
+    def get_tree(self):
+        # Both the project/ and instance/ trees in a single recursive call.
+        with _TREE_LOCK:
+            if not _TREE:
+                response = self.client.send(self.tree_request())
+                response.raise_for_status()
+                _TREE.update(response.json())
+            return _TREE
+
     def get_project_id(self):
-        request = self.client.build_request('GET', self.PROJECT_ID)
-        response = self.client.send(request)
-        return response.json()
+        return self.get_tree()['project']['projectId']
 
     def get_project_number(self):
-        request = self.client.build_request('GET', self.PROJECT_NUMBER)
-        response = self.client.send(request)
-        return response.json()
+        return self.get_tree()['project']['numericProjectId']
+
+    def get_service_account_email(self, service_account='default'):
+        return self.get_tree()['instance']['serviceAccounts'][service_account]['email']
 
     def project_id_request(self):
         return self.client.build_request(
@@ -44,6 +80,25 @@ class Metadata:
             self.PROJECT_NUMBER
         )
 
+    def wait_for_change_request(self, path, last_etag=None, timeout_sec=WAIT_TIMEOUT):
+        params = {'wait_for_change': 'true', 'timeout_sec': timeout_sec}
+        if last_etag:
+            params['last_etag'] = last_etag
+        # The read timeout has to outlast the server-side hang.
+        return self.client.build_request(
+            'GET',
+            path,
+            params=params,
+            timeout=timeout_sec + 5
+        )
+
+    def wait_for_change(self, path, last_etag=None, timeout_sec=WAIT_TIMEOUT):
+        # Long-polls until the value at path differs from last_etag (or the
+        # timeout passes) and returns (value, etag) for the next call.
+        response = self.client.send(self.wait_for_change_request(path, last_etag, timeout_sec))
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
     def get_service_account_token(self, service_account='default'):
         request = self.client.build_request(
             'GET', 
@@ -60,16 +115,24 @@ class Metadata:
             params=self.RECURSIVE
         )
 
+    def fetch_access_token(self, service_account='default'):
+        response = self.client.send(self.service_account_token_request(service_account))
+        response.raise_for_status()
+        return MetadataToken.from_access_response(response)
+
+    def fetch_id_token(self, audience, service_account='default'):
+        response = self.client.send(self.service_account_id_token_request(audience, service_account))
+        response.raise_for_status()
+        return MetadataToken.from_identity_response(response)
+
     def get_service_account_id_token(self, audience, service_account='default'):
-        params = {'audience': audience}
-        params.update(self.RECURSIVE)
-        request = self.client.build_request(
-            'GET',
-            self.IDENTITY.format(service_account=service_account),
-            params=params
+        # Served from the process-wide identity token cache.
+        cache = identity_tokens.get(
+            service_account, 
+            audience, 
+            fetch=lambda: self.fetch_id_token(audience, service_account)
         )
-        response = self.client.send(request)
-        return response.content.decode()
+        return cache.get().token
 
     def service_account_id_token_request(self, audience, service_account='default'):
         params = {'audience': audience}
@@ -81,6 +144,106 @@ class Metadata:
         )
 
 
+class AsyncMetadata(Metadata):
+
+    # AsyncClient pools are bound to the loop they were first used on, so the
+    # shared instance is per event loop; the tree snapshot is still per process.
+    _instances = weakref.WeakKeyDictionary()
+
+    def __init__(self, transport=None):
+        self.client = AsyncClient(
+            base_url=self.BASE_URL,
+            headers=self.HEADERS,
+            params=self.PARAMS,
+            transport=transport
+        )
+        self._tree_task = None
+
+    def __del__(self):
+        # AsyncClient can only be closed from a running loop; see aclose.
+        pass
+
+    @classmethod
+    def shared(cls):
+        loop = asyncio.get_running_loop()
+        instance = cls._instances.get(loop)
+        if instance is None:
+            instance = cls._instances[loop] = cls()
+        return instance
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get_tree(self):
+        if _TREE:
+            return _TREE
+        # Concurrent cold-start callers share one request.
+        if self._tree_task is None:
+            self._tree_task = asyncio.ensure_future(self._fetch_tree())
+        try:
+            return await asyncio.shield(self._tree_task)
+        finally:
+            if self._tree_task is not None and self._tree_task.done():
+                self._tree_task = None
+
+    async def _fetch_tree(self):
+        response = await self.client.send(self.tree_request())
+        response.raise_for_status()
+        tree = response.json()
+        with _TREE_LOCK:
+            _TREE.update(tree)
+        return _TREE
+
+    async def get_project_id(self):
+        return (await self.get_tree())['project']['projectId']
+
+    async def get_project_number(self):
+        return (await self.get_tree())['project']['numericProjectId']
+
+    async def get_service_account_email(self, service_account='default'):
+        return (await self.get_tree())['instance']['serviceAccounts'][service_account]['email']
+
+    async def wait_for_change(self, path, last_etag=None, timeout_sec=Metadata.WAIT_TIMEOUT):
+        response = await self.client.send(self.wait_for_change_request(path, last_etag, timeout_sec))
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
+    async def watch(self, path, timeout_sec=Metadata.WAIT_TIMEOUT):
+        # Yields the current value at path, then each new value as it changes.
+        response = await self.client.send(self.client.build_request('GET', path))
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        yield response.json()
+        while True:
+            new_value, new_etag = await self.wait_for_change(path, etag, timeout_sec)
+            if new_etag != etag:
+                etag = new_etag
+                yield new_value
+
+    async def get_service_account_token(self, service_account='default'):
+        request = self.service_account_token_request(service_account)
+        response = await self.client.send(request)
+        return response.json()['access_token']
+
+    async def fetch_access_token(self, service_account='default'):
+        response = await self.client.send(self.service_account_token_request(service_account))
+        response.raise_for_status()
+        return MetadataToken.from_access_response(response)
+
+    async def fetch_id_token(self, audience, service_account='default'):
+        response = await self.client.send(self.service_account_id_token_request(audience, service_account))
+        response.raise_for_status()
+        return MetadataToken.from_identity_response(response)
+
+    async def get_service_account_id_token(self, audience, service_account='default'):
+        cache = identity_tokens.get(
+            service_account,
+            audience,
+            afetch=lambda: self.fetch_id_token(audience, service_account)
+        )
+        return (await cache.aget()).token
+
+
 # if __name__ == '__main__':
 #     md = Metadata()
 #     print(md.get_project_number())
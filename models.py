@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel
 from httpx import AsyncClient, Request
@@ -50,20 +51,22 @@ class Lifecycle(BaseModel):
     rule: List[RuleItem]
 
 
+# Apart from the name, every field is optional so that partial responses
+# requested with a `fields` projection still validate.
 class Bucket(BaseModel):    
-    kind: str
-    selfLink: str
-    id: str
     name: str
-    projectNumber: str
-    metageneration: str
-    location: str
-    storageClass: str
-    etag: str
-    timeCreated: str
-    updated: str
-    iamConfiguration: IamConfiguration
-    locationType: str
+    kind: Optional[str] = None
+    selfLink: Optional[str] = None
+    id: Optional[str] = None
+    projectNumber: Optional[str] = None
+    metageneration: Optional[str] = None
+    location: Optional[str] = None
+    storageClass: Optional[str] = None
+    etag: Optional[str] = None
+    timeCreated: Optional[str] = None
+    updated: Optional[str] = None
+    iamConfiguration: Optional[IamConfiguration] = None
+    locationType: Optional[str] = None
     rpo: Optional[str] = None
     defaultEventBasedHold: Optional[bool] = None
     versioning: Optional[Versioning] = None
@@ -73,30 +76,109 @@ class Bucket(BaseModel):
     lifecycle: Optional[Lifecycle] = None
 
 class Buckets(BaseModel):
-    kind: str
-    items: List[Bucket]
+    kind: Optional[str] = None
+    items: List[Bucket] = []
+    nextPageToken: Optional[str] = None
 
 
 class Blob(BaseModel):
-    kind: str
-    id: str
-    selfLink: str
-    mediaLink: str
     name: str
-    bucket: str
-    generation: str
-    metageneration: str
-    contentType: str
-    storageClass: str
-    size: str
-    md5Hash: str
-    crc32c: str
-    etag: str
-    timeCreated: str
-    updated: str
-    timeStorageClassUpdated: str
+    kind: Optional[str] = None
+    id: Optional[str] = None
+    selfLink: Optional[str] = None
+    mediaLink: Optional[str] = None
+    bucket: Optional[str] = None
+    generation: Optional[str] = None
+    metageneration: Optional[str] = None
+    contentType: Optional[str] = None
+    storageClass: Optional[str] = None
+    size: Optional[str] = None
+    md5Hash: Optional[str] = None
+    crc32c: Optional[str] = None
+    etag: Optional[str] = None
+    timeCreated: Optional[str] = None
+    updated: Optional[str] = None
+    timeStorageClassUpdated: Optional[str] = None
 
 
 class Blobs(BaseModel):
-    kind: str
-    items: List[Blob]
+    kind: Optional[str] = None
+    items: List[Blob] = []
+    prefixes: List[str] = []
+    nextPageToken: Optional[str] = None
+
+
+def parse_timestamp(value):
+    # GCS timestamps are RFC 3339 in UTC, e.g. 2021-06-01T12:00:00.123Z
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class Record:
+
+    # A read-only view over a raw JSON resource that skips pydantic
+    # validation.  Fields are read straight from the dict; the ones listed in
+    # PARSERS are converted to typed values on first access and memoized.
+    __slots__ = ('data', 'parsed')
+    MODEL = None
+    PARSERS = {}
+
+    def __init__(self, data):
+        self.data = data
+        self.parsed = None
+
+    def __getattr__(self, name):
+        # Slots are unset on instances that pickle and copy are still
+        # rebuilding, and their dunder probes must not reach the dict.
+        if name in Record.__slots__ or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            value = self.data[name]
+        except KeyError:
+            if name in self.MODEL.__fields__:
+                return None
+            raise AttributeError(name) from None
+        parser = self.PARSERS.get(name)
+        if parser is None:
+            return value
+        if self.parsed is None:
+            self.parsed = {}
+        elif name in self.parsed:
+            return self.parsed[name]
+        value = self.parsed[name] = parser(value)
+        return value
+
+    def __repr__(self):
+        return f'{type(self).__name__}(name={self.data.get("name")!r})'
+
+    def __reduce__(self):
+        return type(self), (self.data,)
+
+    def dict(self):
+        return dict(self.data)
+
+    def to_model(self):
+        return self.MODEL(**self.data)
+
+
+class BucketRecord(Record):
+    __slots__ = ()
+    MODEL = Bucket
+    PARSERS = {
+        'projectNumber': int,
+        'metageneration': int,
+        'timeCreated': parse_timestamp,
+        'updated': parse_timestamp
+    }
+
+
+class BlobRecord(Record):
+    __slots__ = ()
+    MODEL = Blob
+    PARSERS = {
+        'size': int,
+        'generation': int,
+        'metageneration': int,
+        'timeCreated': parse_timestamp,
+        'updated': parse_timestamp,
+        'timeStorageClassUpdated': parse_timestamp
+    }
@@ -0,0 +1,105 @@
+import random
+import threading
+from collections import deque
+
+from httpx import TransportError
+
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+# GCS mutations are safe to retry once they carry a precondition.
+PRECONDITIONS = ('ifGenerationMatch', 'ifMetagenerationMatch')
+
+
+def is_idempotent(request):
+    if 'idempotent' in request.extensions:
+        return request.extensions['idempotent']
+    if request.method in IDEMPOTENT_METHODS:
+        return True
+    return any(key in request.url.params for key in PRECONDITIONS)
+
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts=5, initial_backoff=0.1, max_backoff=30.0, multiplier=2.0,
+        statuses=RETRYABLE_STATUSES):
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.statuses = statuses
+
+    def retryable(self, request, response=None, error=None):
+        if not is_idempotent(request):
+            return False
+        if error is not None:
+            return isinstance(error, TransportError)
+        return response.status_code in self.statuses
+
+    def backoff(self, attempt, response=None):
+        # Honours a numeric Retry-After, otherwise exponential with full jitter.
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        ceiling = min(self.max_backoff, self.initial_backoff * self.multiplier ** attempt)
+        return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+
+    def __init__(self, ratio=0.1, max_tokens=100.0):
+        # Every request earns `ratio` tokens and every retry or hedge spends
+        # one, so extra load stays near ratio * traffic even when the backend
+        # is failing everything.
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HedgePolicy:
+
+    def __init__(self, percentile=0.95, min_delay=0.005, max_delay=2.0, window=1000, min_samples=50,
+        refresh_every=100):
+        # A duplicate of an idempotent GET is sent once the first has been
+        # outstanding longer than the observed latency percentile.
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self.samples = deque(maxlen=window)
+        self.recorded = 0
+        self.threshold = None
+
+    def record(self, latency):
+        self.samples.append(latency)
+        self.recorded += 1
+        if self.recorded % self.refresh_every == 0 or self.threshold is None:
+            self.refresh()
+
+    def refresh(self):
+        if len(self.samples) < self.min_samples:
+            return
+        ordered = sorted(self.samples)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+        self.threshold = min(self.max_delay, max(self.min_delay, value))
+
+    def delay(self):
+        # None until enough latencies are recorded to pick a threshold.
+        return self.threshold
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+DEFAULT_RETRY_BUDGET = RetryBudget()
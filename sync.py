@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+from typing import Any, NamedTuple, Optional
+
+from checksums import ChecksumMismatch, StreamVerifier
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS synced (
+    pair TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    generation TEXT NOT NULL,
+    PRIMARY KEY (pair, name)
+)
+'''
+
+
+class Location(NamedTuple):
+    bucket: Optional[str]
+    path: str
+
+    def __str__(self):
+        return self.path if self.bucket is None else f'gs://{self.bucket}/{self.path}'
+
+
+class SyncAction(NamedTuple):
+    kind: str
+    name: str
+    source: Any = None
+    destination: Any = None
+
+
+class ManifestRecord(NamedTuple):
+    size: int
+    mtime_ns: int
+    generation: str
+
+
+def parse_location(location):
+    # 'gs://bucket/prefix' or a local directory.  Prefixes are treated as
+    # directories, so 'gs://bucket/data' means everything under data/.
+    if isinstance(location, Location):
+        return location
+    location = os.fspath(location)
+    if location.startswith('gs://'):
+        bucket, _, prefix = location[len('gs://'):].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return Location(bucket, prefix)
+    return Location(None, os.path.abspath(location))
+
+
+def walk_local(root, relative=''):
+    # Yields (name, stat) for the files under root in GCS listing order.
+    # Directories sort by name + '/', so "a/b" comes after "a-c" exactly as
+    # the flat object names do, and the walk can be merge-joined with a
+    # listing without sorting either side in memory.
+    try:
+        entries = list(os.scandir(os.path.join(root, relative)))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    keyed = sorted(
+        ((entry.name + '/' if entry.is_dir() else entry.name), entry)
+        for entry in entries
+    )
+    for key, entry in keyed:
+        if key.endswith('/'):
+            yield from walk_local(root, relative + key)
+        elif entry.is_file():
+            yield relative + key, entry.stat()
+
+
+async def merge_join(left, right):
+    # Full outer join of two name-sorted async streams of (name, value),
+    # yielding (name, left value or None, right value or None).
+    left, right = left.__aiter__(), right.__aiter__()
+
+    async def advance(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    left_item, right_item = await advance(left), await advance(right)
+    while left_item is not None or right_item is not None:
+        if right_item is None or (left_item is not None and left_item[0] < right_item[0]):
+            yield left_item[0], left_item[1], None
+            left_item = await advance(left)
+        elif left_item is None or right_item[0] < left_item[0]:
+            yield right_item[0], None, right_item[1]
+            right_item = await advance(right)
+        else:
+            yield left_item[0], left_item[1], right_item[1]
+            left_item, right_item = await advance(left), await advance(right)
+
+
+def same_content(blob, other):
+    # Listings alone decide bucket to bucket; no hash means no match.
+    if int(blob.size) != int(other.size):
+        return False
+    if blob.crc32c and other.crc32c:
+        return blob.crc32c == other.crc32c
+    if blob.md5Hash and other.md5Hash:
+        return blob.md5Hash == other.md5Hash
+    return False
+
+
+def file_matches(path, blob):
+    # Hashes a local file against the blob's crc32c or md5Hash.
+    verifier = StreamVerifier(blob)
+    if verifier.crc is None and verifier.md5 is None:
+        return False
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b''):
+            verifier.update(chunk)
+    try:
+        verifier.verify()
+    except ChecksumMismatch:
+        return False
+    return True
+
+
+def compare(stat, blob, record=None):
+    # True or False when size or the manifest decide, None when only
+    # hashing the local file can tell.
+    if stat.st_size != int(blob.size):
+        return False
+    if record is not None and record == (stat.st_size, stat.st_mtime_ns, str(blob.generation)):
+        return True
+    return None
+
+
+class SyncManifest:
+
+    def __init__(self, path=':memory:'):
+        # What the last sync of each (source, destination) pair left behind:
+        # local size and mtime next to the object generation.  When neither
+        # side has moved since, an unchanged file needs no hashing, so a
+        # no-op sync costs a walk and a listing.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get(self, pair, name):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, mtime_ns, generation FROM synced WHERE pair = ? AND name = ?', (pair, name)
+            ).fetchone()
+        return ManifestRecord(*row) if row is not None else None
+
+    def put(self, pair, name, stat, generation):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?, ?)',
+                (pair, name, stat.st_size, stat.st_mtime_ns, str(generation))
+            )
+
+    def discard(self, pair, name):
+        with self.lock:
+            self.db.execute('DELETE FROM synced WHERE pair = ? AND name = ?', (pair, name))
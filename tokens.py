@@ -0,0 +1,122 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Tokens are refreshed in the background once they are this close to expiry,
+# and refreshed in the foreground once they are within EXPIRY_MARGIN of it.
+REFRESH_MARGIN = 300
+EXPIRY_MARGIN = 30
+IDENTITY_CACHE_SIZE = 256
+
+
+class TokenCache:
+
+    def __init__(self, fetch, afetch=None, refresh_margin=REFRESH_MARGIN, expiry_margin=EXPIRY_MARGIN):
+        # fetch is a callable returning a MetadataToken and afetch its
+        # coroutine counterpart; either may be None if that path is unused.
+        # Sync callers share an in-flight refresh through the lock, async
+        # callers through the pending task.
+        self.fetch = fetch
+        self.afetch = afetch
+        self.refresh_margin = refresh_margin
+        self.expiry_margin = expiry_margin
+        self.token = None
+        self.lock = threading.Lock()
+        self.task = None
+
+    def usable(self, token):
+        return token is not None and not token.expires_within(self.expiry_margin)
+
+    def get(self):
+        token = self.token
+        if not self.usable(token):
+            return self.refresh(stale=token)
+        if token.expires_within(self.refresh_margin):
+            self.refresh_in_background()
+        return token
+
+    def refresh(self, stale=None):
+        # stale is the token the caller found unusable; if another caller
+        # already replaced it, that token is returned without a new fetch.
+        with self.lock:
+            if self.token is not stale and self.usable(self.token):
+                return self.token
+            self.token = self.fetch()
+            return self.token
+
+    def refresh_in_background(self):
+        if not self.lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.token = self.fetch()
+        except Exception:
+            # The foreground path retries once the token actually expires.
+            pass
+        finally:
+            self.lock.release()
+
+    async def aget(self):
+        token = self.token
+        if not self.usable(token):
+            return await self.arefresh(stale=token)
+        if token.expires_within(self.refresh_margin) and self.task is None:
+            self.start_refresh().add_done_callback(self._discard_failure)
+        return token
+
+    async def arefresh(self, stale=None):
+        if self.token is not stale and self.usable(self.token):
+            return self.token
+        task = self.task or self.start_refresh()
+        # Shielded so one cancelled caller doesn't cancel everyone's refresh.
+        return await asyncio.shield(task)
+
+    def start_refresh(self):
+        self.task = asyncio.ensure_future(self._afetch())
+        return self.task
+
+    async def _afetch(self):
+        try:
+            self.token = await self.afetch()
+            return self.token
+        finally:
+            self.task = None
+
+    @staticmethod
+    def _discard_failure(task):
+        if not task.cancelled():
+            task.exception()
+
+
+class IdentityTokenCache:
+
+    def __init__(self, maxsize=IDENTITY_CACHE_SIZE, refresh_margin=REFRESH_MARGIN):
+        # One TokenCache per (service_account, audience), least recently used
+        # evicted first.  Expiry comes from each JWT's own exp claim.
+        self.maxsize = maxsize
+        self.refresh_margin = refresh_margin
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, service_account, audience, fetch=None, afetch=None):
+        key = (service_account, audience)
+        with self.lock:
+            cache = self.entries.get(key)
+            if cache is None:
+                cache = self.entries[key] = TokenCache(fetch, afetch, self.refresh_margin)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(key)
+                cache.fetch = cache.fetch or fetch
+                cache.afetch = cache.afetch or afetch
+            return cache
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+identity_tokens = IdentityTokenCache()
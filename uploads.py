@@ -0,0 +1,135 @@
+import json
+import os
+from concurrency import aiter_items
+
+# Resumable upload chunks must be multiples of 256 KiB, except the last.
+UPLOAD_GRANULARITY = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 32 * UPLOAD_GRANULARITY
+# compose accepts at most 32 source objects per call.
+MAX_COMPOSE_PARTS = 32
+
+
+class UploadError(Exception):
+    ...
+
+
+def check_chunk_size(chunk_size):
+    if chunk_size <= 0 or chunk_size % UPLOAD_GRANULARITY:
+        raise UploadError(f'chunk_size must be a positive multiple of {UPLOAD_GRANULARITY} bytes')
+    return chunk_size
+
+
+def content_range(offset, length, total=None):
+    total = '*' if total is None else total
+    if not length:
+        return f'bytes */{total}'
+    return f'bytes {offset}-{offset + length - 1}/{total}'
+
+
+def persisted_offset(response):
+    # A 308 carries "Range: bytes=0-N" once any bytes are persisted.
+    committed = response.headers.get('Range')
+    if not committed:
+        return 0
+    return int(committed.rsplit('-', 1)[1]) + 1
+
+
+def supports_buffer(source):
+    try:
+        memoryview(source)
+    except TypeError:
+        return False
+    return True
+
+
+class UploadSource:
+
+    def __init__(self, source, start=0, length=None):
+        # source is a file path, a bytes-like object or an (async) iterable
+        # of bytes.  Paths and buffers are seekable and can be windowed with
+        # start/length, which is what resuming and composite parts rely on.
+        self.fd = None
+        self.view = None
+        self.iterator = None
+        self.start = start
+        if isinstance(source, (str, os.PathLike)):
+            self.fd = os.open(source, os.O_RDONLY)
+            total = os.fstat(self.fd).st_size
+        elif not hasattr(source, '__aiter__') and supports_buffer(source):
+            self.view = memoryview(source).cast('B')
+            total = len(self.view)
+        else:
+            self.iterator = aiter_items(source).__aiter__()
+            self.buffer = bytearray()
+            self.buffer_offset = 0
+            self.exhausted = False
+            self.size = None
+            return
+        self.size = total - start if length is None else min(length, total - start)
+
+    @property
+    def seekable(self):
+        return self.iterator is None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def read(self, offset, length):
+        # Returns (chunk, is_last) for the bytes at offset, relative to start.
+        if self.seekable:
+            length = max(0, min(length, self.size - offset))
+            if self.fd is not None:
+                chunk = os.pread(self.fd, length, self.start + offset)
+            else:
+                chunk = self.view[self.start + offset:self.start + offset + length]
+            return chunk, offset + length >= self.size
+
+        if offset < self.buffer_offset:
+            raise UploadError('Cannot rewind a streamed upload source')
+        del self.buffer[:offset - self.buffer_offset]
+        self.buffer_offset = offset
+        # Read one byte past the chunk to know whether it is the last one.
+        while len(self.buffer) <= length and not self.exhausted:
+            try:
+                self.buffer += await self.iterator.__anext__()
+            except StopAsyncIteration:
+                self.exhausted = True
+        chunk = bytes(self.buffer[:length])
+        return chunk, self.exhausted and len(self.buffer) <= length
+
+
+class ResumeState:
+
+    def __init__(self, path):
+        # Upload progress keyed by "bucket/name", rewritten atomically after
+        # every committed chunk so a restarted process can pick it back up.
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as src:
+                self.data = json.load(src)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.save()
+
+    def discard(self, key):
+        if self.data.pop(key, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as dest:
+            json.dump(self.data, dest)
+        os.replace(tmp, self.path)